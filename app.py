@@ -1,8 +1,9 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context, g
 import os
 import json
 from werkzeug.utils import secure_filename
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 import PyPDF2
 import docx
@@ -12,27 +13,206 @@ from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
 from pptx.dml.color import RGBColor
 from pptx.chart.data import CategoryChartData
 from pptx.enum.chart import XL_CHART_TYPE
-from pptx.enum.shapes import MSO_SHAPE
+from pptx.enum.shapes import MSO_SHAPE, PP_PLACEHOLDER
+from pptx.shapes.autoshape import Shape
+from pptx.parts.chart import ChartPart
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import qn, nsdecls
 import chromadb
 from chromadb.utils import embedding_functions
 import uuid
+from io import BytesIO, StringIO
+from xml.sax.saxutils import escape, quoteattr
+import csv
+import gzip
 import re
+import hashlib
+import copy
+import zipfile
+import tempfile
+import math
+from collections import OrderedDict
+import threading
+import shutil
+import time
+import sqlite3
+import multiprocessing
+from contextlib import contextmanager
+import contextvars
+import logging
+import cProfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Uploads are stored once per SHA-256 under UPLOAD_STORE next to a gzipped
+# sidecar of their extracted text, so re-uploading a document skips parsing.
+# The least recently uploaded objects go first beyond UPLOAD_STORE_MAX_BYTES.
+app.config['UPLOAD_STORE'] = os.path.join(app.config['UPLOAD_FOLDER'], '_store')
+app.config['UPLOAD_STORE_MAX_BYTES'] = int(os.getenv('UPLOAD_STORE_MAX_BYTES', str(2 * 1024 ** 3)))
+# Files too large for one /upload request (MAX_CONTENT_LENGTH) are sent in
+# parts of up to UPLOAD_PART_MAX_BYTES through /uploads; parts wait under
+# UPLOAD_PARTS_FOLDER until the upload is finalized, or are dropped once it has
+# been idle for UPLOAD_SESSION_TTL_SECONDS.
+app.config['UPLOAD_PARTS_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], '_parts')
+app.config['UPLOAD_PART_MAX_BYTES'] = int(os.getenv('UPLOAD_PART_MAX_BYTES', str(64 * 1024 * 1024)))
+app.config['UPLOAD_MAX_BYTES'] = int(os.getenv('UPLOAD_MAX_BYTES', str(app.config['UPLOAD_STORE_MAX_BYTES'])))
+app.config['UPLOAD_SESSION_TTL_SECONDS'] = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', str(24 * 3600)))
 app.config['OUTPUT_FOLDER'] = 'outputs'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+# "master" renders from cached per-scheme slide layouts; "shapes" draws the
+# background and header shapes on every slide.
+app.config['RENDER_MODE'] = os.getenv('RENDER_MODE', 'master')
+# Rendered slides are memoized by a hash of (slide data, color scheme, render
+# mode) so unchanged slides are copied rather than rebuilt; 0 disables.
+app.config['SLIDE_CACHE_SIZE'] = int(os.getenv('SLIDE_CACHE_SIZE', '512'))
+# Tables with more than TABLE_ROWS_PER_SLIDE rows continue on further slides
+# with the header repeated. Chart series longer than CHART_MAX_POINTS are
+# averaged into that many buckets; pie charts keep their largest slices and
+# fold the rest into "Other" beyond CHART_MAX_SLICES.
+app.config['TABLE_ROWS_PER_SLIDE'] = int(os.getenv('TABLE_ROWS_PER_SLIDE', '14'))
+app.config['CHART_MAX_POINTS'] = int(os.getenv('CHART_MAX_POINTS', '60'))
+app.config['CHART_MAX_SLICES'] = 8
+# With PROFILING_ENABLED=1 a request carrying "X-Profile: 1" is run under
+# cProfile and its stats are written to PROFILE_FOLDER.
+app.config['PROFILING_ENABLED'] = os.getenv('PROFILING_ENABLED', '0') == '1'
+app.config['PROFILE_FOLDER'] = 'profiles'
+# Bulk rendering (/batch_render and batch_render.py) runs decks in a process
+# pool of RENDER_WORKERS; one request may carry up to BATCH_MAX_DECKS.
+app.config['RENDER_WORKERS'] = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+app.config['BATCH_MAX_DECKS'] = 1000
+
+# Rendered decks are named by a hash of their structure so identical decks
+# are stored once; files unused for OUTPUT_MAX_AGE_SECONDS are deleted and the
+# oldest go first once the folder exceeds OUTPUT_MAX_BYTES.
+app.config['OUTPUT_MAX_AGE_SECONDS'] = int(os.getenv('OUTPUT_MAX_AGE_SECONDS', str(24 * 3600)))
+app.config['OUTPUT_MAX_BYTES'] = int(os.getenv('OUTPUT_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# A file larger than the store would be evicted as soon as it was stored
+if app.config['UPLOAD_MAX_BYTES'] > app.config['UPLOAD_STORE_MAX_BYTES']:
+    raise ValueError(f"UPLOAD_MAX_BYTES ({app.config['UPLOAD_MAX_BYTES']}) must not exceed "
+                     f"UPLOAD_STORE_MAX_BYTES ({app.config['UPLOAD_STORE_MAX_BYTES']})")
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-chroma_client = chromadb.Client()
-collection = None
+# Directory of the on-disk vector index; set CHROMA_PATH="" for an in-memory
+# index, or CHROMA_HOST to share a Chroma server between workers.
+app.config['CHROMA_PATH'] = os.getenv('CHROMA_PATH', 'chroma_db')
+app.config['CHROMA_HOST'] = os.getenv('CHROMA_HOST', '')
+app.config['CHROMA_PORT'] = int(os.getenv('CHROMA_PORT', '8000'))
+app.config['WARM_INDEX'] = os.getenv('WARM_INDEX', '1') == '1'
+
+# Text extraction runs in a process pool (0 workers extracts inline); large
+# PDFs are split into page ranges so one file can use several cores, and
+# later files of an upload start while earlier ones are indexed. At most
+# EXTRACTION_MAX_PENDING ranges in all are extracted ahead of indexing.
+# Text files are read inline, a block of about TXT_BYTES_PER_TASK at a time.
+app.config['EXTRACTION_WORKERS'] = int(os.getenv('EXTRACTION_WORKERS', os.cpu_count() or 1))
+app.config['PDF_PAGES_PER_TASK'] = 25
+app.config['TXT_BYTES_PER_TASK'] = 4 * 1024 * 1024
+app.config['EXTRACTION_MAX_PENDING'] = 2 * max(app.config['EXTRACTION_WORKERS'], 1)
+app.config['EMBED_BATCH_SIZE'] = 64
+
+# Chunk sizes are in (approximate) model tokens so retrieved context can be
+# budgeted against the model's context window.
+app.config['CHUNK_TOKENS'] = int(os.getenv('CHUNK_TOKENS', '400'))
+app.config['CHUNK_OVERLAP_TOKENS'] = int(os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+
+# Background jobs (deck generation, rendering and indexing) run on a bounded
+# thread pool; submissions beyond JOB_QUEUE_LIMIT active jobs are rejected.
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '2'))
+app.config['JOB_QUEUE_LIMIT'] = int(os.getenv('JOB_QUEUE_LIMIT', '32'))
+app.config['JOB_TTL_SECONDS'] = 3600
+
+# "parallel" generation mode: one short outline call, then up to
+# SLIDE_PARALLELISM concurrent per-slide calls, each retried on its own.
+app.config['SLIDE_PARALLELISM'] = int(os.getenv('SLIDE_PARALLELISM', '4'))
+app.config['SLIDE_RETRIES'] = int(os.getenv('SLIDE_RETRIES', '1'))
+app.config['SLIDE_CONTEXT_RESULTS'] = 3
+
+# With EMBEDDING_SERVICE_URL set, chunks and queries are embedded by the shared
+# embedding_service.py process instead of a model loaded in every worker.
+app.config['EMBEDDING_SERVICE_URL'] = os.getenv('EMBEDDING_SERVICE_URL', '')
+app.config['EMBEDDING_TIMEOUT'] = float(os.getenv('EMBEDDING_TIMEOUT', '60'))
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# Each tenant (user or project) has its own collection; "default" keeps the
+# original "documents" collection. At most INDEX_HANDLE_CACHE collection
+# handles are kept open, least recently used first out.
+app.config['INDEX_HANDLE_CACHE'] = int(os.getenv('INDEX_HANDLE_CACHE', '32'))
+DEFAULT_TENANT = 'default'
+TENANT_RE = re.compile(r'[A-Za-z0-9](?:[A-Za-z0-9_-]{0,62}[A-Za-z0-9])?')
+
+# Retrieval fuses vector search with a local BM25 index (reciprocal rank
+# fusion of RETRIEVAL_CANDIDATES hits from each), drops duplicate chunks and
+# packs the best ones into CONTEXT_TOKEN_BUDGET tokens (per-slide calls in
+# parallel mode use SLIDE_CONTEXT_TOKEN_BUDGET).
+app.config['HYBRID_RETRIEVAL'] = os.getenv('HYBRID_RETRIEVAL', '1') == '1'
+app.config['RETRIEVAL_CANDIDATES'] = 20
+app.config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1200'))
+app.config['SLIDE_CONTEXT_TOKEN_BUDGET'] = int(os.getenv('SLIDE_CONTEXT_TOKEN_BUDGET', '500'))
+
+chroma_client = None
+collections = OrderedDict()
+keyword_indexes = {}
+keyword_rebuilds = set()
+keyword_lock = threading.Lock()
+embedding_function = None
+index_load_seconds = {}
+index_lock = threading.Lock()
+extraction_pool = None
+render_pool = None
+
+OLLAMA_URL = os.getenv('OLLAMA_URL', "http://localhost:11434/api/generate")
 MODEL_NAME = "llama3.2:3b"
+TEMPERATURE = 0.7
+
+# All model calls share one keep-alive client. At most OLLAMA_MAX_CONCURRENCY
+# generations are in flight per process; the rest wait up to
+# OLLAMA_QUEUE_TIMEOUT seconds for a slot.
+app.config['OLLAMA_MAX_CONCURRENCY'] = int(os.getenv('OLLAMA_MAX_CONCURRENCY', '2'))
+app.config['OLLAMA_QUEUE_TIMEOUT'] = float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '120'))
+app.config['OLLAMA_CONNECT_TIMEOUT'] = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+app.config['OLLAMA_READ_TIMEOUT'] = float(os.getenv('OLLAMA_READ_TIMEOUT', '300'))
+app.config['OLLAMA_RETRIES'] = int(os.getenv('OLLAMA_RETRIES', '2'))
+app.config['OLLAMA_BACKOFF_SECONDS'] = 0.5
+
+ollama_client = None
+
+# asgi.py (async serving) offloads retrieval and parsing to a pool of
+# ASGI_THREADS threads and serves the remaining Flask routes from another.
+app.config['ASGI_THREADS'] = int(os.getenv('ASGI_THREADS', '32'))
+
+# Model responses are cached by a hash of (model, prompt, context,
+# temperature): an in-memory LRU of LLM_CACHE_SIZE entries, plus an on-disk
+# tier under LLM_CACHE_DIR (disabled when empty) with TTL and size eviction.
+app.config['LLM_CACHE_SIZE'] = int(os.getenv('LLM_CACHE_SIZE', '256'))
+app.config['LLM_CACHE_DIR'] = os.getenv('LLM_CACHE_DIR', '')
+app.config['LLM_CACHE_TTL_SECONDS'] = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+app.config['LLM_CACHE_MAX_BYTES'] = int(os.getenv('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
 
-sessions = {}
+response_cache = None
+
+# Refinement sessions expire after SESSION_TTL_SECONDS idle and are evicted
+# least-recently-used beyond SESSION_MAX_COUNT / SESSION_MAX_BYTES. Setting
+# SESSION_DB to a SQLite file keeps them across restarts and shares them
+# between workers. Only the last SESSION_HISTORY_LIMIT attempts are replayed.
+app.config['SESSION_TTL_SECONDS'] = int(os.getenv('SESSION_TTL_SECONDS', str(24 * 3600)))
+app.config['SESSION_MAX_COUNT'] = int(os.getenv('SESSION_MAX_COUNT', '1000'))
+app.config['SESSION_MAX_BYTES'] = int(os.getenv('SESSION_MAX_BYTES', str(64 * 1024 * 1024)))
+app.config['SESSION_DB'] = os.getenv('SESSION_DB', '')
+app.config['SESSION_HISTORY_LIMIT'] = 5
+
+session_store = None
+
+jobs = {}
+jobs_lock = threading.Lock()
+job_executor = None
+
+# Extra color schemes are loaded at startup from THEMES_PATH: a JSON or YAML
+# file, or a directory of them, mapping theme names to their colors.
+app.config['THEMES_PATH'] = os.getenv('THEMES_PATH', '')
 
 # Professional color schemes
 COLOR_SCHEMES = {
@@ -59,49 +239,1296 @@ COLOR_SCHEMES = {
     }
 }
 
-def extract_text_from_pdf(file_path):
-    text = ""
+logger = logging.getLogger('rag_pptx')
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms in Prometheus text format"""
+    
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.custom_buckets = {}
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+    
+    def define_histogram(self, name, buckets):
+        """Use non-default bucket bounds for a histogram"""
+        self.custom_buckets[name] = tuple(buckets)
+    
+    @staticmethod
+    def series(name, labels):
+        return (name, tuple(sorted(labels.items())))
+    
+    def inc(self, name, value=1, **labels):
+        key = self.series(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.series(name, labels)] = value
+    
+    def observe(self, name, value, **labels):
+        key = self.series(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                buckets = self.custom_buckets.get(name, self.buckets)
+                histogram = self.histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+    
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for key, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+    
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, store in (('counter', self.counters), ('gauge', self.gauges)):
+                seen = set()
+                for (name, labels), value in sorted(store.items()):
+                    if name not in seen:
+                        lines.append(f'# TYPE {name} {kind}')
+                        seen.add(name)
+                    lines.append(f'{name}{self.format_labels(labels)} {value}')
+            seen = set()
+            for (name, labels), (buckets, counts, total, count) in sorted(self.histograms.items()):
+                if name not in seen:
+                    lines.append(f'# TYPE {name} histogram')
+                    seen.add(name)
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{self.format_labels(labels, [("le", bound)])} {bucket_count}')
+                lines.append(f'{name}_bucket{self.format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{self.format_labels(labels)} {total}')
+                lines.append(f'{name}_count{self.format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.define_histogram('rag_llm_tokens_per_second', (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+# The trace of the request (or background job) the current code runs for
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def new_trace(**fields):
+    trace = {'trace_id': uuid.uuid4().hex, 'spans': []}
+    trace.update(fields)
+    return trace
+
+def record_span(name, seconds, **attributes):
+    """Record a finished stage in the stage histogram and the current trace"""
+    metrics.observe('rag_stage_duration_seconds', seconds, stage=name)
+    trace = current_trace.get()
+    if trace is not None:
+        span = {'name': name, 'ms': round(seconds * 1000, 2)}
+        span.update(attributes)
+        trace['spans'].append(span)
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a named stage; the yielded dict collects extra attributes"""
+    started = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record_span(name, time.perf_counter() - started, **attributes)
+
+def log_trace(trace, **fields):
+    """Emit one structured log line for a finished request or job"""
+    entry = dict(trace)
+    entry.update(fields)
+    logger.info(json.dumps(entry, default=str))
+
+def record_llm_usage(body):
+    """Turn Ollama's eval counters into token metrics; returns span attributes"""
+    eval_count = body.get('eval_count') or 0
+    eval_duration = (body.get('eval_duration') or 0) / 1e9
+    prompt_tokens = body.get('prompt_eval_count') or 0
+    metrics.inc('rag_llm_prompt_tokens_total', prompt_tokens)
+    metrics.inc('rag_llm_completion_tokens_total', eval_count)
+    usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': eval_count}
+    if eval_count and eval_duration:
+        usage['tokens_per_second'] = round(eval_count / eval_duration, 2)
+        metrics.observe('rag_llm_tokens_per_second', eval_count / eval_duration)
+    return usage
+
+def iter_pdf_pages(file_path, start=0, stop=None):
+    """Yield the text of each page in [start, stop) of a PDF"""
     with open(file_path, 'rb') as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-    return text
+        stop = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+        for page_number in range(start, stop):
+            yield (pdf_reader.pages[page_number].extract_text() or "") + "\n"
 
-def extract_text_from_docx(file_path):
+def iter_txt_pages(file_path, start=0, stop=None):
+    """Yield the lines starting in bytes [start, stop) of a UTF-8 text file as one page"""
+    with open(file_path, 'rb') as file:
+        if start:
+            # The line running across start belongs to the previous range
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        lines = []
+        while stop is None or position < stop:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            lines.append(line)
+    yield b''.join(lines).decode('utf-8').replace('\r\n', '\n')
+
+def count_pdf_pages(file_path):
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def iter_docx_paragraphs(file_path):
     doc = docx.Document(file_path)
-    text = ""
     for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+        yield paragraph.text + "\n"
+
+def extract_text_from_pdf(file_path):
+    return "".join(iter_pdf_pages(file_path))
+
+def extract_text_from_docx(file_path):
+    return "".join(iter_docx_paragraphs(file_path))
 
 def extract_text_from_txt(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
-def chunk_text(text, chunk_size=500, overlap=50):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append(chunk)
-    return chunks
+EXTRACTORS = {
+    '.pdf': extract_text_from_pdf,
+    '.docx': extract_text_from_docx,
+    '.txt': extract_text_from_txt
+}
 
-def query_ollama(prompt, context=""):
-    full_prompt = f"{context}\n\n{prompt}" if context else prompt
+def extract_pages(file_path, start=0, stop=None):
+    """Process-pool task: extract one document, or one page range of a PDF or
+    byte range of a text file.
+
+    Returns the pages and the seconds the worker spent parsing them.
+    """
+    started = time.perf_counter()
+    if file_path.endswith('.pdf'):
+        pages = list(iter_pdf_pages(file_path, start, stop))
+    elif file_path.endswith('.txt'):
+        pages = list(iter_txt_pages(file_path, start, stop))
+    else:
+        pages = [EXTRACTORS[os.path.splitext(file_path)[1]](file_path)]
+    return pages, time.perf_counter() - started
+
+def get_extraction_pool():
+    """Return the shared extraction process pool, or None to extract inline"""
+    global extraction_pool
+    if extraction_pool is None and app.config['EXTRACTION_WORKERS'] > 0:
+        extraction_pool = ProcessPoolExecutor(max_workers=app.config['EXTRACTION_WORKERS'])
+    return extraction_pool
+
+def extraction_ranges(file_path):
+    if file_path.endswith('.pdf'):
+        step = app.config['PDF_PAGES_PER_TASK']
+        return [(start, start + step) for start in range(0, count_pdf_pages(file_path), step)]
+    if file_path.endswith('.txt'):
+        step = app.config['TXT_BYTES_PER_TASK']
+        return [(start, start + step) for start in range(0, os.path.getsize(file_path), step)] or [(0, None)]
+    return [(0, None)]
+
+class ExtractionTasks:
+    """Extraction of one document as futures for its page ranges, in order.
+
+    Only EXTRACTION_MAX_PENDING ranges are submitted to the pool ahead of the
+    consumer, counting those of the other documents in its group, and ranges
+    extracted inline are only read as they are iterated, so parsed pages of a
+    large file never pile up in memory.
+    """
+    
+    def __init__(self, file_path, group=None):
+        self.file_path = file_path
+        self.ranges = None
+        self.pending = []
+        self.submitted = 0
+        self.group = group if group is not None else []
+        self.group.append(self)
+    
+    @property
+    def inline(self):
+        # Plain text is read faster than it can be shipped to a worker
+        return get_extraction_pool() is None or self.file_path.endswith('.txt')
+    
+    def start(self):
+        """Begin extracting the first ranges in the pool; iterating starts it too"""
+        if self.ranges is None:
+            self.ranges = extraction_ranges(self.file_path)
+        limit = 0 if self.inline else max(app.config['EXTRACTION_MAX_PENDING'], 1)
+        while (len(self.pending) < limit - queued_ranges(self.group, self)
+               and self.submitted < len(self.ranges)):
+            self.submit_next()
+    
+    def submit_next(self):
+        start, stop = self.ranges[self.submitted]
+        self.submitted += 1
+        if not self.inline:
+            self.pending.append(get_extraction_pool().submit(extract_pages, self.file_path, start, stop))
+            return
+        future = Future()
+        try:
+            future.set_result(extract_pages(self.file_path, start, stop))
+        except Exception as e:
+            future.set_exception(e)
+        self.pending.append(future)
+    
+    @property
+    def fraction_done(self):
+        if not self.ranges:
+            return 0.0
+        return (self.submitted - len(self.pending)) / len(self.ranges)
+    
+    def __iter__(self):
+        self.start()
+        while self.pending or self.submitted < len(self.ranges):
+            if not self.pending:
+                self.submit_next()
+            future = self.pending.pop(0)
+            self.start()
+            yield future
+        self.group.remove(self)
+
+def queued_ranges(group, exclude=None):
+    """Ranges submitted to the pool and not yet consumed, across a group"""
+    return sum(len(tasks.pending) for tasks in group if tasks is not exclude and not tasks.inline)
+
+def submit_extraction(file_path, group=None):
+    """Start extracting a document in the pool (inline documents are read
+    lazily instead); returns its ExtractionTasks"""
+    tasks = ExtractionTasks(file_path, group)
+    tasks.start()
+    return tasks
+
+def iter_extracted_pages(futures, timings=None):
+    """Yield pages in document order as their extraction tasks finish.
+
+    If given, timings accumulates 'extract' (worker parse time) and 'wait'
+    (time this thread blocked on the pool).
+    """
+    for future in futures:
+        started = time.perf_counter()
+        pages, seconds = future.result()
+        if timings is not None:
+            timings['wait'] = timings.get('wait', 0.0) + time.perf_counter() - started
+            timings['extract'] = timings.get('extract', 0.0) + seconds
+        yield from pages
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_RE = re.compile(r'\S.*?(?:[.!?]+["\')\]]*(?=\s|$)|\n\s*\n|$)', re.S)
+WORD_RE = re.compile(r'\S+')
+PARAGRAPH_BREAK_RE = re.compile(r'[ \t\r]*\n\s*\n')
+
+def count_tokens(text):
+    """Approximate the model's token count: one per word or punctuation mark"""
+    return sum(1 for _ in TOKEN_RE.finditer(text))
+
+def sentence_tail(sentence, budget):
+    """Return the trailing words of a sentence that fit in budget tokens"""
+    text, _, page, start, end, _ = sentence
+    tail_start = None
+    tail_tokens = 0
+    for word in reversed(list(WORD_RE.finditer(text))):
+        word_tokens = count_tokens(word.group())
+        if tail_tokens + word_tokens > budget:
+            break
+        tail_start = word.start()
+        tail_tokens += word_tokens
+    if tail_start is None:
+        return None
+    return text[tail_start:], tail_tokens, page, start + tail_start, end, False
+
+def iter_sentences(pages, max_tokens):
+    """Yield (text, tokens, page, start, end, paragraph_end) for each sentence.
+
+    Offsets are character positions in the concatenated document. Sentences
+    longer than max_tokens are split on word boundaries.
+    """
+    offset = 0
+    for page_number, page in enumerate(pages, 1):
+        for match in SENTENCE_RE.finditer(page):
+            raw = match.group()
+            text = raw.rstrip()
+            if not text:
+                continue
+            paragraph_end = (raw[len(text):].count('\n') >= 2
+                             or PARAGRAPH_BREAK_RE.match(page, match.end()) is not None
+                             or match.end() == len(page))
+            start = offset + match.start()
+            tokens = count_tokens(text)
+            
+            if tokens <= max_tokens:
+                yield text, tokens, page_number, start, start + len(text), paragraph_end
+                continue
+            
+            piece_start = piece_end = None
+            piece_tokens = 0
+            for word in WORD_RE.finditer(text):
+                word_tokens = count_tokens(word.group())
+                if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+                    yield (text[piece_start:piece_end], piece_tokens, page_number,
+                           start + piece_start, start + piece_end, False)
+                    piece_start = None
+                    piece_tokens = 0
+                if piece_start is None:
+                    piece_start = word.start()
+                piece_end = word.end()
+                piece_tokens += word_tokens
+            if piece_start is not None:
+                yield (text[piece_start:piece_end], piece_tokens, page_number,
+                       start + piece_start, start + piece_end, paragraph_end)
+        offset += len(page)
+
+def iter_chunks(text, max_tokens=None, overlap_tokens=None):
+    """Yield sentence-aligned chunks of a string or an iterable of pages.
+
+    Each chunk is a dict with its text, approximate token count, source page
+    range and character offsets. Chunks close early at a paragraph break once
+    they are reasonably full, and carry whole trailing sentences as overlap,
+    or the last sentence's trailing words when it alone exceeds the overlap.
+    """
+    max_tokens = max_tokens or app.config['CHUNK_TOKENS']
+    overlap_tokens = app.config['CHUNK_OVERLAP_TOKENS'] if overlap_tokens is None else overlap_tokens
+    pages = [text] if isinstance(text, str) else text
+    
+    window = []
+    window_tokens = 0
+    fresh = False
+    
+    def make_chunk():
+        return {
+            'text': ' '.join(sentence[0] for sentence in window),
+            'tokens': window_tokens,
+            'page_start': window[0][2],
+            'page_end': window[-1][2],
+            'start': window[0][3],
+            'end': window[-1][4]
+        }
+    
+    # Leave room for the overlap next to a sentence split at the budget
+    split_tokens = max_tokens - overlap_tokens if overlap_tokens < max_tokens else max_tokens
     
-    payload = {
+    for sentence in iter_sentences(pages, split_tokens):
+        tokens = sentence[1]
+        
+        if fresh and window_tokens + tokens > max_tokens:
+            yield make_chunk()
+            fresh = False
+            carry = []
+            carry_tokens = 0
+            for previous in reversed(window):
+                if carry_tokens + previous[1] > overlap_tokens:
+                    break
+                carry.insert(0, previous)
+                carry_tokens += previous[1]
+            if not carry and window and overlap_tokens > 0:
+                tail = sentence_tail(window[-1], overlap_tokens)
+                if tail:
+                    carry, carry_tokens = [tail], tail[1]
+            window, window_tokens = carry, carry_tokens
+        
+        while window and window_tokens + tokens > max_tokens:
+            window_tokens -= window.pop(0)[1]
+        
+        window.append(sentence)
+        window_tokens += tokens
+        fresh = True
+        
+        if sentence[5] and window_tokens >= max_tokens * 0.6:
+            yield make_chunk()
+            window = []
+            window_tokens = 0
+            fresh = False
+    
+    if fresh:
+        yield make_chunk()
+
+def chunk_text(text, chunk_size=None, overlap=None):
+    """Yield the text of each chunk; chunk_size and overlap are in tokens"""
+    for chunk in iter_chunks(text, chunk_size, overlap):
+        yield chunk['text']
+
+class EmbeddingBatcher:
+    """Buffer new chunks and add them to the collection in fixed-size batches"""
+    
+    def __init__(self, collection, batch_size):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.added = 0
+        self.seconds = 0.0
+    
+    def add(self, chunk_id, document, metadata):
+        self.ids.append(chunk_id)
+        self.documents.append(document)
+        self.metadatas.append(metadata)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        if self.ids:
+            started = time.perf_counter()
+            with span('embed', chunks=len(self.ids)):
+                embed = get_embedding_function()
+                self.collection.add(
+                    documents=self.documents,
+                    embeddings=embed(self.documents) if embed else None,
+                    metadatas=self.metadatas,
+                    ids=self.ids
+                )
+            self.seconds += time.perf_counter() - started
+            self.added += len(self.ids)
+            self.ids, self.documents, self.metadatas = [], [], []
+
+EXTRACTION_CACHE_VERSION = 2
+
+# Stored paths being indexed, with how many requests or jobs hold each;
+# prune_upload_store never evicts them
+stored_in_use = {}
+stored_in_use_lock = threading.Lock()
+
+def hold_stored(path):
+    with stored_in_use_lock:
+        stored_in_use[path] = stored_in_use.get(path, 0) + 1
+
+def release_stored(paths):
+    with stored_in_use_lock:
+        for path in paths:
+            stored_in_use[path] -= 1
+            if not stored_in_use[path]:
+                del stored_in_use[path]
+
+def store_path(file_hash, extension):
+    return os.path.join(app.config['UPLOAD_STORE'], file_hash[:2], f"{file_hash}{extension}")
+
+def store_blocks(blocks, extension):
+    """Stream blocks of bytes into the content-addressed store, hashing them
+    as they are written; returns their SHA-256 and stored path.
+
+    The path is held against eviction until the caller passes it to
+    release_stored.
+    """
+    os.makedirs(app.config['UPLOAD_STORE'], exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_STORE'], suffix='.tmp', delete=False) as temp:
+        for block in blocks:
+            digest.update(block)
+            temp.write(block)
+    file_hash = digest.hexdigest()
+    path = store_path(file_hash, extension)
+    hold_stored(path)
+    if os.path.exists(path):
+        os.remove(temp.name)
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp.name, path)
+    return file_hash, path
+
+def store_upload(file, extension):
+    """Store an uploaded file; returns its SHA-256 and stored path, held like store_blocks"""
+    return store_blocks(iter(lambda: file.stream.read(1024 * 1024), b''), extension)
+
+def sidecar_path(path):
+    return f"{path}.pages.json.gz"
+
+def load_extracted_pages(path):
+    """Iterator over the pages extracted by an earlier upload of the same file, or None.
+
+    The sidecar holds a version line and then one JSON string per page, so
+    pages are read one at a time.
+    """
+    try:
+        file = gzip.open(sidecar_path(path), 'rt', encoding='utf-8')
+    except OSError:
+        return None
+    try:
+        header = json.loads(file.readline())
+        if not isinstance(header, dict) or header.get('version') != EXTRACTION_CACHE_VERSION:
+            file.close()
+            return None
+    except (OSError, ValueError):
+        file.close()
+        return None
+    return iter_sidecar_pages(file)
+
+def iter_sidecar_pages(file):
+    with file:
+        for line in file:
+            yield json.loads(line)
+
+def iter_saving_pages(path, pages):
+    """Pass pages through while writing them to the file's sidecar, which only
+    replaces the old one once every page has gone by"""
+    temp_path = f"{sidecar_path(path)}.{uuid.uuid4().hex}.tmp"
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=6) as file:
+            file.write(json.dumps({'version': EXTRACTION_CACHE_VERSION}) + '\n')
+            for page in pages:
+                file.write(json.dumps(page, ensure_ascii=False) + '\n')
+                yield page
+        os.replace(temp_path, sidecar_path(path))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def save_extracted_pages(path, pages):
+    for _ in iter_saving_pages(path, pages):
+        pass
+
+def prune_upload_store():
+    """Delete the least recently uploaded objects, with their sidecars, until
+    the store is under UPLOAD_STORE_MAX_BYTES; held objects are skipped"""
+    objects = {}
+    total = 0
+    for root, _, filenames in os.walk(app.config['UPLOAD_STORE']):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if filename.endswith('.tmp'):
+                continue
+            blob = path[:-len('.pages.json.gz')] if filename.endswith('.pages.json.gz') else path
+            entry = objects.setdefault(blob, [0.0, 0])
+            entry[1] += stat.st_size
+            if blob == path:
+                entry[0] = stat.st_mtime
+    
+    removed = 0
+    for blob, (used, size) in sorted(objects.items(), key=lambda item: item[1][0]):
+        if total <= app.config['UPLOAD_STORE_MAX_BYTES']:
+            break
+        with stored_in_use_lock:
+            if blob in stored_in_use:
+                continue
+            for path in (blob, sidecar_path(blob)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        total -= size
+        removed += 1
+    if removed:
+        metrics.inc('rag_upload_store_evicted_total', removed)
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class RemoteEmbeddingFunction(chromadb.EmbeddingFunction):
+    """Embed through the shared embedding service"""
+    
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+    
+    def __call__(self, input):
+        response = self.session.post(f"{self.url}/embed", json={'texts': list(input)}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['embeddings']
+    
+    @staticmethod
+    def name():
+        return 'embedding-service'
+    
+    def get_config(self):
+        return {'url': self.url, 'timeout': self.timeout}
+    
+    @staticmethod
+    def build_from_config(config):
+        return RemoteEmbeddingFunction(config['url'], config.get('timeout', 60))
+
+def get_embedding_function():
+    """The remote embedder, or None to let Chroma embed in-process"""
+    global embedding_function
+    if embedding_function is None and app.config['EMBEDDING_SERVICE_URL']:
+        embedding_function = RemoteEmbeddingFunction(
+            app.config['EMBEDDING_SERVICE_URL'],
+            app.config['EMBEDDING_TIMEOUT']
+        )
+    return embedding_function
+
+def get_chroma_client():
+    """Open the configured Chroma client on first use"""
+    global chroma_client
+    if chroma_client is None:
+        if app.config['CHROMA_HOST']:
+            chroma_client = chromadb.HttpClient(
+                host=app.config['CHROMA_HOST'],
+                port=app.config['CHROMA_PORT']
+            )
+        elif app.config['CHROMA_PATH']:
+            chroma_client = chromadb.PersistentClient(path=app.config['CHROMA_PATH'])
+        else:
+            chroma_client = chromadb.Client()
+    return chroma_client
+
+def valid_tenant(tenant):
+    return isinstance(tenant, str) and TENANT_RE.fullmatch(tenant) is not None
+
+def collection_name(tenant):
+    return "documents" if tenant == DEFAULT_TENANT else f"documents_{tenant}"
+
+def get_collection(tenant=DEFAULT_TENANT, create=True):
+    """Return a tenant's collection, loading it from disk on first use.
+
+    With create=False a tenant without a collection gets None instead of a
+    new empty one.
+    """
+    with index_lock:
+        if tenant in collections:
+            collections.move_to_end(tenant)
+            return collections[tenant]
+        
+        started = time.perf_counter()
+        client = get_chroma_client()
+        if create:
+            loaded = client.get_or_create_collection(
+                name=collection_name(tenant),
+                metadata={"hnsw:space": "cosine"}
+            )
+        else:
+            try:
+                loaded = client.get_collection(name=collection_name(tenant))
+            except (chromadb.errors.NotFoundError, ValueError):
+                return None
+        loaded.count()
+        index_load_seconds[tenant] = time.perf_counter() - started
+        collections[tenant] = loaded
+        while len(collections) > app.config['INDEX_HANDLE_CACHE']:
+            evicted, _ = collections.popitem(last=False)
+            keyword_indexes.pop(evicted, None)
+        return loaded
+
+def list_tenants():
+    """Tenant names of every collection in the index"""
+    tenants = []
+    for entry in get_chroma_client().list_collections():
+        name = getattr(entry, 'name', entry)
+        if name == "documents":
+            tenants.append(DEFAULT_TENANT)
+        elif name.startswith("documents_"):
+            tenants.append(name[len("documents_"):])
+    return sorted(tenants)
+
+def delete_tenant(tenant):
+    """Drop a tenant's collection; False if it had none.
+
+    Stored uploads are shared by content hash and age out of the store.
+    """
+    with index_lock:
+        collections.pop(tenant, None)
+        keyword_indexes.pop(tenant, None)
+        index_load_seconds.pop(tenant, None)
+        try:
+            get_chroma_client().delete_collection(name=collection_name(tenant))
+        except (chromadb.errors.NotFoundError, ValueError):
+            return False
+    return True
+
+def warm_index():
+    """Load the index in the background so startup is not blocked"""
+    thread = threading.Thread(target=get_collection, name='warm-index', daemon=True)
+    thread.start()
+    return thread
+
+def directory_size(path):
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+def indexed_files(collection):
+    """Map each indexed source file to its content hash and chunk ids"""
+    records = collection.get(include=['metadatas'])
+    files = {}
+    for chunk_id, metadata in zip(records['ids'], records['metadatas']):
+        metadata = metadata or {}
+        entry = files.setdefault(metadata.get('source'), {
+            'file_hash': metadata.get('file_hash'),
+            'ids': set()
+        })
+        entry['ids'].add(chunk_id)
+    return files
+
+class OllamaBusy(Exception):
+    pass
+
+class OllamaClient:
+    """Shared keep-alive HTTP client for Ollama with a cap on in-flight generations"""
+    
+    RETRY_STATUSES = (429, 502, 503, 504)
+    
+    def __init__(self, url, max_concurrency=2, queue_timeout=120, connect_timeout=5,
+                 read_timeout=300, retries=2, backoff=0.5):
+        self.url = url
+        self.queue_timeout = queue_timeout
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_concurrency, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.stats_lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'rejected': 0,
+            'in_flight': 0,
+            'queue_wait_seconds': 0.0,
+            'queue_wait_max_seconds': 0.0,
+            'generation_seconds': 0.0,
+            'generation_max_seconds': 0.0
+        }
+    
+    def record(self, **values):
+        with self.stats_lock:
+            for key, value in values.items():
+                if key.endswith('_max_seconds'):
+                    self.counters[key] = max(self.counters[key], value)
+                else:
+                    self.counters[key] += value
+    
+    def stats(self):
+        with self.stats_lock:
+            return dict(self.counters)
+    
+    @contextmanager
+    def slot(self):
+        """Wait for a generation slot, recording how long the caller queued"""
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.record(rejected=1)
+            raise OllamaBusy(f'No Ollama slot free after {self.queue_timeout:.0f}s')
+        waited = time.perf_counter() - started
+        self.record(queue_wait_seconds=waited, queue_wait_max_seconds=waited, in_flight=1)
+        try:
+            yield
+        finally:
+            self.record(in_flight=-1)
+            self.slots.release()
+    
+    def post(self, payload, stream=False):
+        """POST to Ollama, retrying connection failures and transient statuses with backoff"""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, json=payload, stream=stream, timeout=self.timeout)
+                if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                    response.close()
+                else:
+                    response.raise_for_status()
+                    return response
+            except requests.ConnectionError:
+                if attempt == self.retries:
+                    raise
+            self.record(retries=1)
+            time.sleep(self.backoff * 2 ** attempt)
+    
+    def generate(self, payload):
+        """Run a non-streaming generation and return Ollama's JSON body"""
+        with self.slot():
+            started = time.perf_counter()
+            self.record(requests=1)
+            try:
+                response = self.post(payload)
+                return response.json()
+            except Exception:
+                self.record(errors=1)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(generation_seconds=elapsed, generation_max_seconds=elapsed)
+    
+    def generate_stream(self, payload):
+        """Yield each decoded NDJSON message of a streaming generation"""
+        with self.slot():
+            started = time.perf_counter()
+            self.record(requests=1)
+            try:
+                with self.post(payload, stream=True) as response:
+                    for line in response.iter_lines():
+                        if line:
+                            yield json.loads(line)
+            except Exception:
+                self.record(errors=1)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(generation_seconds=elapsed, generation_max_seconds=elapsed)
+
+def get_ollama_client():
+    global ollama_client
+    if ollama_client is None:
+        ollama_client = OllamaClient(
+            OLLAMA_URL,
+            max_concurrency=app.config['OLLAMA_MAX_CONCURRENCY'],
+            queue_timeout=app.config['OLLAMA_QUEUE_TIMEOUT'],
+            connect_timeout=app.config['OLLAMA_CONNECT_TIMEOUT'],
+            read_timeout=app.config['OLLAMA_READ_TIMEOUT'],
+            retries=app.config['OLLAMA_RETRIES'],
+            backoff=app.config['OLLAMA_BACKOFF_SECONDS']
+        )
+    return ollama_client
+
+class ResponseCache:
+    """Content-addressed cache of model responses with memory and disk tiers"""
+    
+    def __init__(self, max_entries=256, directory='', ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    @staticmethod
+    def key(model, prompt, context, temperature):
+        material = json.dumps([model, prompt, context, temperature], ensure_ascii=False)
+        return sha256_text(material)
+    
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+    
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                self.counters['memory_hits'] += 1
+                return self.entries[key]
+        
+        if self.directory:
+            try:
+                with open(self.path(key), 'r', encoding='utf-8') as file:
+                    entry = json.load(file)
+                if time.time() - entry['created'] <= self.ttl:
+                    self.remember(key, entry['response'])
+                    self.count(hits=1, disk_hits=1)
+                    return entry['response']
+                os.remove(self.path(key))
+                self.count(evictions=1)
+            except (OSError, ValueError, KeyError):
+                pass
+        
+        self.count(misses=1)
+        return None
+    
+    def remember(self, key, response):
+        with self.lock:
+            self.entries[key] = response
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+    
+    def put(self, key, response):
+        self.remember(key, response)
+        self.count(stores=1)
+        if not self.directory:
+            return
+        
+        temp_path = f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'created': time.time(), 'response': response}, file)
+        os.replace(temp_path, self.path(key))
+        self.evict_disk()
+    
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.directory:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+    
+    def evict_disk(self):
+        """Drop expired files, then the oldest ones until under max_bytes"""
+        files = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                os.remove(entry.path)
+                self.count(evictions=1)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.count(evictions=1)
+    
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self.entries)
+        stats['disk_enabled'] = bool(self.directory)
+        return stats
+
+def get_response_cache():
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache(
+            max_entries=app.config['LLM_CACHE_SIZE'],
+            directory=app.config['LLM_CACHE_DIR'],
+            ttl=app.config['LLM_CACHE_TTL_SECONDS'],
+            max_bytes=app.config['LLM_CACHE_MAX_BYTES']
+        )
+    return response_cache
+
+def response_cache_key(prompt, context=""):
+    return ResponseCache.key(MODEL_NAME, prompt, context, TEMPERATURE)
+
+class SessionStore:
+    """Refinement sessions with TTL and LRU eviction, optionally backed by SQLite"""
+    
+    def __init__(self, ttl=24 * 3600, max_sessions=1000, max_bytes=64 * 1024 * 1024, db_path=''):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'created': 0, 'expired': 0, 'evictions': 0}
+        if db_path:
+            with self.connect() as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS sessions '
+                    '(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)'
+                )
+                db.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)')
+    
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+    
+    def get(self, session_id):
+        """Return the session, or None if it never existed or has expired"""
+        now = time.time()
+        if self.db_path:
+            with self.connect() as db:
+                row = db.execute('SELECT data, updated FROM sessions WHERE id = ?', (session_id,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+                    self.count(expired=1)
+                    return None
+                db.execute('UPDATE sessions SET updated = ? WHERE id = ?', (now, session_id))
+            return json.loads(row[0])
+        
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            if now - entry['updated'] > self.ttl:
+                del self.entries[session_id]
+                self.counters['expired'] += 1
+                return None
+            entry['updated'] = now
+            self.entries.move_to_end(session_id)
+            return entry['session']
+    
+    def create(self, session_id):
+        session = {'history': [], 'iterations': 0, 'attempts': 0, 'last_structure': None}
+        self.count(created=1)
+        self.save(session_id, session)
+        return session
+    
+    def save(self, session_id, session):
+        data = json.dumps(session, ensure_ascii=False, separators=(',', ':'))
+        now = time.time()
+        if self.db_path:
+            with self.connect() as db:
+                db.execute(
+                    'INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)',
+                    (session_id, data, now)
+                )
+            self.evict_db()
+            return
+        
+        with self.lock:
+            self.entries[session_id] = {'session': session, 'size': len(data), 'updated': now}
+            self.entries.move_to_end(session_id)
+            self.evict_memory(now)
+    
+    def count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+    
+    def evict_memory(self, now):
+        """Drop expired sessions, then the least recently used; caller holds the lock"""
+        for session_id in [key for key, entry in self.entries.items() if now - entry['updated'] > self.ttl]:
+            del self.entries[session_id]
+            self.counters['expired'] += 1
+        total = sum(entry['size'] for entry in self.entries.values())
+        while len(self.entries) > 1 and (len(self.entries) > self.max_sessions or total > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            total -= entry['size']
+            self.counters['evictions'] += 1
+    
+    def evict_db(self):
+        with self.connect() as db:
+            expired = db.execute('DELETE FROM sessions WHERE updated < ?', (time.time() - self.ttl,)).rowcount
+            count, size = db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions').fetchone()
+            evicted = 0
+            if count > self.max_sessions or size > self.max_bytes:
+                for session_id, length in db.execute('SELECT id, LENGTH(data) FROM sessions ORDER BY updated').fetchall():
+                    if count <= 1 or (count <= self.max_sessions and size <= self.max_bytes):
+                        break
+                    db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+                    count -= 1
+                    size -= length
+                    evicted += 1
+        self.count(expired=expired, evictions=evicted)
+    
+    def stats(self):
+        if self.db_path:
+            with self.connect() as db:
+                count, size = db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions').fetchone()
+        else:
+            with self.lock:
+                count = len(self.entries)
+                size = sum(entry['size'] for entry in self.entries.values())
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update({'sessions': count, 'bytes': size, 'persistent': bool(self.db_path)})
+        return stats
+
+def get_session_store():
+    global session_store
+    if session_store is None:
+        session_store = SessionStore(
+            ttl=app.config['SESSION_TTL_SECONDS'],
+            max_sessions=app.config['SESSION_MAX_COUNT'],
+            max_bytes=app.config['SESSION_MAX_BYTES'],
+            db_path=app.config['SESSION_DB']
+        )
+    return session_store
+
+def ollama_payload(prompt, context="", stream=False):
+    full_prompt = f"{context}\n\n{prompt}" if context else prompt
+    return {
         "model": MODEL_NAME,
         "prompt": full_prompt,
-        "stream": False,
-        "temperature": 0.7
+        "stream": stream,
+        "temperature": TEMPERATURE
     }
+
+def query_ollama(prompt, context="", use_cache=True):
+    """Return the model's response, served from the cache unless use_cache is False"""
+    key = response_cache_key(prompt, context)
+    if use_cache:
+        cached = get_response_cache().get(key)
+        if cached is not None:
+            return cached
     
     try:
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        return response.json()['response']
+        with span('llm', stream=False) as attributes:
+            body = get_ollama_client().generate(ollama_payload(prompt, context))
+            attributes.update(record_llm_usage(body))
+        response = body['response']
     except Exception as e:
         return f"Error querying Ollama: {str(e)}"
+    
+    get_response_cache().put(key, response)
+    return response
+
+def stream_ollama(prompt, context="", use_cache=True):
+    """Yield response fragments from Ollama's NDJSON stream as they arrive"""
+    key = response_cache_key(prompt, context)
+    if use_cache:
+        cached = get_response_cache().get(key)
+        if cached is not None:
+            yield cached
+            return
+    
+    fragments = []
+    started = time.perf_counter()
+    first_token = None
+    for chunk in get_ollama_client().generate_stream(ollama_payload(prompt, context, stream=True)):
+        if chunk.get('error'):
+            raise RuntimeError(chunk['error'])
+        if chunk.get('response'):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            fragments.append(chunk['response'])
+            yield chunk['response']
+        if chunk.get('done'):
+            usage = record_llm_usage(chunk)
+            if first_token is not None:
+                usage['first_token_ms'] = round(first_token * 1000, 2)
+            record_span('llm', time.perf_counter() - started, stream=True, **usage)
+            get_response_cache().put(key, "".join(fragments))
+            break
+
+TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+CODE_FENCE_RE = re.compile(r'```(?:json)?')
+
+def loads_tolerant(text):
+    """json.loads that forgives the trailing commas small models often emit"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(TRAILING_COMMA_RE.sub(r'\1', text))
+
+class SlideStreamParser:
+    """Incrementally pull complete slide objects out of a partial JSON deck.
+
+    Feed it text fragments as they stream in; every time an object inside the
+    top-level "slides" array closes it is decoded and returned.
+    """
+    
+    HEADER_FIELDS = ('title', 'subtitle', 'color_scheme')
+    
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.current_key = None
+        self.slides_depth = None
+        self.slide_start = None
+        self.slides_started = False
+        self.slides = []
+    
+    def feed(self, fragment):
+        """Consume a fragment and return the list of slides it completed"""
+        self.buffer += fragment
+        completed = []
+        buffer = self.buffer
+        
+        for i in range(self.pos, len(buffer)):
+            ch = buffer[i]
+            
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = buffer[self.string_start:i]
+                continue
+            
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i + 1
+            elif ch == ':' and self.depth == 1:
+                self.current_key = self.last_string
+            elif ch in '{[':
+                if ch == '[' and self.depth == 1 and self.current_key == 'slides':
+                    self.slides_depth = self.depth + 1
+                    self.slides_started = True
+                elif ch == '{' and self.slides_depth is not None and self.depth == self.slides_depth:
+                    self.slide_start = i
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if ch == '}' and self.slide_start is not None and self.depth == self.slides_depth:
+                    try:
+                        slide = loads_tolerant(buffer[self.slide_start:i + 1])
+                    except ValueError:
+                        slide = None
+                    if isinstance(slide, dict):
+                        self.slides.append(slide)
+                        completed.append(slide)
+                    self.slide_start = None
+                elif ch == ']' and self.slides_depth is not None and self.depth == self.slides_depth - 1:
+                    self.slides_depth = None
+        
+        self.pos = len(buffer)
+        return completed
+    
+    def header(self):
+        """Return the deck-level fields that precede the slides array"""
+        end = self.buffer.find('"slides"')
+        prefix = self.buffer if end == -1 else self.buffer[:end]
+        header = {}
+        for field in self.HEADER_FIELDS:
+            match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % field, prefix)
+            if match:
+                try:
+                    header[field] = json.loads(f'"{match.group(1)}"')
+                except ValueError:
+                    header[field] = match.group(1)
+        return header
+    
+    def structure(self):
+        """Assemble whatever has been recovered so far into a deck structure"""
+        structure = {
+            'title': 'Generated Presentation',
+            'subtitle': '',
+            'color_scheme': 'corporate_blue'
+        }
+        structure.update(self.header())
+        structure['slides'] = list(self.slides)
+        return structure
+
+def sse_event(event, data):
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 def apply_text_formatting(text_frame, text, font_size=18, bold=False, color=None):
     """Apply sophisticated text formatting"""
@@ -113,88 +1540,279 @@ def apply_text_formatting(text_frame, text, font_size=18, bold=False, color=None
         if color:
             paragraph.font.color.rgb = color
 
-def add_styled_title_slide(prs, title, subtitle, color_scheme):
-    """Create a sophisticated title slide"""
+XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+HEX_COLOR_RE = re.compile(r'#?([0-9A-Fa-f]{6})')
+THEME_NAME_RE = re.compile(r'[a-z0-9_]{1,40}')
+THEME_COLORS = ('primary', 'secondary', 'accent', 'text', 'light')
+WHITE = RGBColor(255, 255, 255)
+
+def solid_fill_xml(color):
+    return f'<a:solidFill><a:srgbClr val="{color}"/></a:solidFill>'
+
+def run_properties_xml(font_size, bold=False, color=None, font=None):
+    bold_attribute = ' b="1"' if bold else ''
+    latin = f'<a:latin typeface={quoteattr(font)}/>' if font else ''
+    return f'<a:rPr lang="en-US" sz="{font_size * 100}"{bold_attribute} dirty="0">{solid_fill_xml(color) if color else ""}{latin}</a:rPr>'
+
+def text_style(font_size, bold=False, color=None, font=None, space_after=None):
+    """Paragraph and run property XML shared by every paragraph of one text style"""
+    spacing = f'<a:spcAft><a:spcPts val="{space_after * 100}"/></a:spcAft>' if space_after else ''
+    paragraph_properties = f'<a:pPr>{spacing}</a:pPr>' if spacing else ''
+    return paragraph_properties, run_properties_xml(font_size, bold, color, font)
+
+def table_cell_style(font_size, bold=False, color=None, fill=None):
+    """Run and cell property XML shared by every cell of one row style"""
+    cell_properties = f'<a:tcPr>{solid_fill_xml(fill) if fill else ""}</a:tcPr>'
+    return run_properties_xml(font_size, bold, color), cell_properties
+
+def compile_theme(scheme):
+    """Turn a color scheme into the text, table and chart styles every render reuses"""
+    font = scheme.get('font', 'Calibri')
+    text = scheme['text']
+    theme = dict(scheme, font=font)
+    theme['styles'] = {
+        'title': text_style(44, bold=True, color=WHITE, font=font),
+        'subtitle': text_style(24, color=text, font=font),
+        'slide_title': text_style(32, bold=True, color=WHITE, font=font),
+        'bullet': text_style(20, color=text, font=font, space_after=12),
+        'column': text_style(18, color=text, font=font),
+        'numbered': text_style(20, color=text, font=font, space_after=12)
+    }
+    theme['table'] = {
+        'header': table_cell_style(14, bold=True, color=WHITE, fill=scheme['primary']),
+        'plain': table_cell_style(12),
+        # Alternate row colors
+        'band': table_cell_style(12, fill=scheme['light'])
+    }
+    theme['palette'] = scheme.get('palette') or [scheme['primary'], scheme['secondary'], scheme['accent'], text]
+    return theme
+
+def parse_theme_color(name, key, value):
+    match = HEX_COLOR_RE.fullmatch(value) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f'theme "{name}": {key} must be a hex color like "#003366", got {value!r}')
+    return RGBColor.from_string(match.group(1).upper())
+
+def parse_theme(name, spec):
+    """Validate one custom theme definition and return its color scheme"""
+    if not isinstance(name, str) or not THEME_NAME_RE.fullmatch(name):
+        raise ValueError(f'theme name {name!r} must be 1-40 lowercase letters, digits or underscores')
+    if not isinstance(spec, dict):
+        raise ValueError(f'theme "{name}": expected a mapping of colors')
+    unknown = set(spec) - set(THEME_COLORS) - {'font', 'palette'}
+    if unknown:
+        raise ValueError(f'theme "{name}": unknown keys {", ".join(sorted(map(str, unknown)))}')
+    scheme = {key: parse_theme_color(name, key, spec.get(key)) for key in THEME_COLORS}
+    if 'font' in spec:
+        if not isinstance(spec['font'], str) or not spec['font'].strip():
+            raise ValueError(f'theme "{name}": font must be a font name')
+        scheme['font'] = spec['font'].strip()
+    if 'palette' in spec:
+        if not isinstance(spec['palette'], list) or not spec['palette']:
+            raise ValueError(f'theme "{name}": palette must be a non-empty list of colors')
+        scheme['palette'] = [parse_theme_color(name, 'palette', color) for color in spec['palette']]
+    return scheme
+
+def load_themes(path):
+    """Read custom color schemes from a JSON/YAML file or a directory of them"""
+    if not path:
+        return {}
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith(('.json', '.yaml', '.yml'))
+        )
+    else:
+        files = [path]
+    
+    themes = {}
+    for file_path in files:
+        try:
+            with open(file_path, encoding='utf-8') as file:
+                if file_path.endswith('.json'):
+                    data = json.load(file)
+                else:
+                    try:
+                        import yaml
+                    except ImportError:
+                        raise ValueError('PyYAML is required for YAML themes (pip install pyyaml)')
+                    try:
+                        data = yaml.safe_load(file)
+                    except yaml.YAMLError as e:
+                        raise ValueError(f'invalid YAML: {e}')
+            if not isinstance(data, dict):
+                raise ValueError('expected a mapping of theme names to themes')
+            for name, spec in data.items():
+                themes[name] = parse_theme(name, spec)
+        except ValueError as e:
+            raise ValueError(f'{file_path}: {e}') from e
+    return themes
+
+# Built-in and THEMES_PATH schemes, validated and compiled once at startup
+COLOR_SCHEMES.update(load_themes(app.config['THEMES_PATH']))
+THEMES = {name: compile_theme(scheme) for name, scheme in COLOR_SCHEMES.items()}
+
+def get_theme(color_scheme_name):
+    """The compiled theme for a scheme name, or the default theme"""
+    return THEMES.get(color_scheme_name) or THEMES['corporate_blue']
+
+def color_scheme_choices():
+    """The scheme names as prompt text: "a", "b", or "c" """
+    names = [f'"{name}"' for name in THEMES]
+    return names[0] if len(names) == 1 else f'{", ".join(names[:-1])}, or {names[-1]}'
+
+def add_text_box(slide, left, top, width, height, lines, style, word_wrap=False):
+    """Add a text box with one paragraph per line, all in one precompiled style"""
+    box = slide.shapes.add_textbox(left, top, width, height)
+    if word_wrap:
+        box.text_frame.word_wrap = True
+    paragraph_properties, run_properties = style
+    paragraphs = []
+    for line in lines:
+        text = XML_INVALID_RE.sub('', '' if line is None else str(line)).replace('\r\n', '\n')
+        runs = f'<a:br>{run_properties}</a:br>'.join(
+            f'<a:r>{run_properties}<a:t>{escape(part)}</a:t></a:r>' for part in text.split('\n')
+        )
+        paragraphs.append(f'<a:p>{paragraph_properties}{runs}</a:p>')
+    
+    txBody = box.text_frame._txBody
+    for p in txBody.p_lst:
+        txBody.remove(p)
+    for p in list(parse_xml(f'<a:txBody {nsdecls("a")}>{"".join(paragraphs) or "<a:p/>"}</a:txBody>')):
+        txBody.append(p)
+    return box
+
+THEME_TITLE_LAYOUT = 'Themed Title'
+THEME_CONTENT_LAYOUT = 'Themed Content'
+
+theme_templates = {}
+theme_templates_lock = threading.Lock()
+slide_cache = OrderedDict()
+slide_cache_lock = threading.Lock()
+
+def add_filled_rectangle(shapes, left, top, width, height, color):
+    """Add a borderless solid rectangle"""
+    shape = shapes.add_shape(MSO_SHAPE.RECTANGLE, left, top, width, height)
+    shape.fill.solid()
+    shape.fill.fore_color.rgb = color
+    shape.line.fill.background()
+    return shape
+
+def add_layout_rectangle(layout, left, top, width, height, color):
+    """Add a borderless solid rectangle to a slide layout's shape tree"""
+    sp_tree = layout.shapes._spTree
+    shape_id = max([int(shape_id) for shape_id in sp_tree.xpath('//p:cNvPr/@id')] + [1]) + 1
+    sp = sp_tree.add_autoshape(shape_id, f'Rectangle {shape_id}', 'rect', left, top, width, height)
+    shape = Shape(sp, None)
+    shape.fill.solid()
+    shape.fill.fore_color.rgb = color
+    shape.line.fill.background()
+
+def build_theme_template(color_scheme):
+    """Build a one-master template whose layouts already carry the scheme's backgrounds and bars.
+
+    Slides created from these layouts only need their own content shapes,
+    instead of each repeating a full-slide rectangle and header bar.
+    """
+    prs = Presentation()
+    prs.slide_width = Inches(10)
+    prs.slide_height = Inches(7.5)
+    
+    title_layout = prs.slide_layouts.get_by_name('Title Only')
+    content_layout = prs.slide_layouts.get_by_name('Blank')
+    for layout in list(prs.slide_layouts):
+        if layout not in (title_layout, content_layout):
+            prs.slide_layouts.remove(layout)
+    
+    # Drop the title placeholder so slides do not inherit an empty title box
+    for placeholder in list(title_layout.placeholders):
+        if placeholder.placeholder_format.type == PP_PLACEHOLDER.TITLE:
+            placeholder._element.getparent().remove(placeholder._element)
+    
+    title_layout._element.cSld.set('name', THEME_TITLE_LAYOUT)
+    title_layout.background.fill.solid()
+    title_layout.background.fill.fore_color.rgb = color_scheme['light']
+    add_layout_rectangle(title_layout, 0, 0, prs.slide_width, Inches(1.5), color_scheme['primary'])
+    
+    content_layout._element.cSld.set('name', THEME_CONTENT_LAYOUT)
+    content_layout.background.fill.solid()
+    content_layout.background.fill.fore_color.rgb = RGBColor(255, 255, 255)
+    add_layout_rectangle(content_layout, 0, 0, prs.slide_width, Inches(0.8), color_scheme['primary'])
+    
+    buffer = BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+def get_theme_template(color_scheme_name):
+    """Return the cached themed template package for a color scheme"""
+    template = theme_templates.get(color_scheme_name)
+    if template is None:
+        with theme_templates_lock:
+            template = theme_templates.get(color_scheme_name)
+            if template is None:
+                template = build_theme_template(THEMES[color_scheme_name])
+                theme_templates[color_scheme_name] = template
+    return template
+
+def add_title_chrome_slide(prs, color_scheme):
+    """Add a title slide with the light background and accent bar"""
+    layout = prs.slide_layouts.get_by_name(THEME_TITLE_LAYOUT)
+    if layout is not None:
+        return prs.slides.add_slide(layout)
+    
     slide = prs.slides.add_slide(prs.slide_layouts[6])  # Blank layout
     
     # Add background shape
-    background = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, prs.slide_height
-    )
-    background.fill.solid()
-    background.fill.fore_color.rgb = color_scheme['light']
-    background.line.fill.background()
+    add_filled_rectangle(slide.shapes, 0, 0, prs.slide_width, prs.slide_height, color_scheme['light'])
     
     # Add accent bar
-    accent_bar = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, Inches(1.5)
+    add_filled_rectangle(slide.shapes, 0, 0, prs.slide_width, Inches(1.5), color_scheme['primary'])
+    return slide
+
+def add_content_chrome_slide(prs, title, color_scheme):
+    """Add a content slide with white background, header bar and title"""
+    layout = prs.slide_layouts.get_by_name(THEME_CONTENT_LAYOUT)
+    if layout is not None:
+        slide = prs.slides.add_slide(layout)
+    else:
+        slide = prs.slides.add_slide(prs.slide_layouts[6])
+        
+        # Background
+        add_filled_rectangle(slide.shapes, 0, 0, prs.slide_width, prs.slide_height, RGBColor(255, 255, 255))
+        
+        # Header bar
+        add_filled_rectangle(slide.shapes, 0, 0, prs.slide_width, Inches(0.8), color_scheme['primary'])
+    
+    # Title
+    add_text_box(
+        slide, Inches(0.5), Inches(0.15),
+        prs.slide_width - Inches(1), Inches(0.5),
+        [title], color_scheme['styles']['slide_title']
     )
-    accent_bar.fill.solid()
-    accent_bar.fill.fore_color.rgb = color_scheme['primary']
-    accent_bar.line.fill.background()
+    return slide
+
+def add_styled_title_slide(prs, title, subtitle, color_scheme):
+    """Create a sophisticated title slide"""
+    slide = add_title_chrome_slide(prs, color_scheme)
     
     # Add title
-    title_box = slide.shapes.add_textbox(
-        Inches(0.5), Inches(0.3),
-        prs.slide_width - Inches(1), Inches(1)
+    add_text_box(
+        slide, Inches(0.5), Inches(0.3),
+        prs.slide_width - Inches(1), Inches(1),
+        [title], color_scheme['styles']['title']
     )
-    title_frame = title_box.text_frame
-    title_frame.text = title
-    title_frame.paragraphs[0].font.size = Pt(44)
-    title_frame.paragraphs[0].font.bold = True
-    title_frame.paragraphs[0].font.name = 'Calibri'
-    title_frame.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
     
     # Add subtitle
     if subtitle:
-        subtitle_box = slide.shapes.add_textbox(
-            Inches(0.5), Inches(2),
-            prs.slide_width - Inches(1), Inches(1)
+        add_text_box(
+            slide, Inches(0.5), Inches(2),
+            prs.slide_width - Inches(1), Inches(1),
+            [subtitle], color_scheme['styles']['subtitle']
         )
-        subtitle_frame = subtitle_box.text_frame
-        subtitle_frame.text = subtitle
-        subtitle_frame.paragraphs[0].font.size = Pt(24)
-        subtitle_frame.paragraphs[0].font.name = 'Calibri'
-        subtitle_frame.paragraphs[0].font.color.rgb = color_scheme['text']
 
 def add_content_slide(prs, title, content, color_scheme, layout_type='bullet'):
     """Create sophisticated content slides with various layouts"""
-    slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    # Background
-    background = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, prs.slide_height
-    )
-    background.fill.solid()
-    background.fill.fore_color.rgb = RGBColor(255, 255, 255)
-    background.line.fill.background()
-    
-    # Header bar
-    header = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, Inches(0.8)
-    )
-    header.fill.solid()
-    header.fill.fore_color.rgb = color_scheme['primary']
-    header.line.fill.background()
-    
-    # Title
-    title_box = slide.shapes.add_textbox(
-        Inches(0.5), Inches(0.15),
-        prs.slide_width - Inches(1), Inches(0.5)
-    )
-    title_frame = title_box.text_frame
-    title_frame.text = title
-    title_frame.paragraphs[0].font.size = Pt(32)
-    title_frame.paragraphs[0].font.bold = True
-    title_frame.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
+    slide = add_content_chrome_slide(prs, title, color_scheme)
     
     # Content based on layout type
     if layout_type == 'bullet':
@@ -206,125 +1824,114 @@ def add_content_slide(prs, title, content, color_scheme, layout_type='bullet'):
 
 def add_bullet_content(slide, points, color_scheme):
     """Add bullet point content"""
-    content_box = slide.shapes.add_textbox(
-        Inches(0.7), Inches(1.2),
-        Inches(8.6), Inches(5.5)
+    add_text_box(
+        slide, Inches(0.7), Inches(1.2), Inches(8.6), Inches(5.5),
+        points, color_scheme['styles']['bullet'], word_wrap=True
     )
-    text_frame = content_box.text_frame
-    text_frame.word_wrap = True
-    
-    for i, point in enumerate(points):
-        if i == 0:
-            p = text_frame.paragraphs[0]
-        else:
-            p = text_frame.add_paragraph()
-        
-        p.text = point
-        p.level = 0
-        p.font.size = Pt(20)
-        p.font.name = 'Calibri'
-        p.font.color.rgb = color_scheme['text']
-        p.space_after = Pt(12)
-        
-        # Add bullet
-        p.bullet = True
 
 def add_two_column_content(slide, content, color_scheme):
     """Add two-column layout content"""
     mid_point = len(content) // 2
-    left_content = content[:mid_point]
-    right_content = content[mid_point:]
     
     # Left column
-    left_box = slide.shapes.add_textbox(
-        Inches(0.7), Inches(1.2),
-        Inches(4), Inches(5.5)
+    add_text_box(
+        slide, Inches(0.7), Inches(1.2), Inches(4), Inches(5.5),
+        content[:mid_point], color_scheme['styles']['column'], word_wrap=True
     )
-    left_frame = left_box.text_frame
-    left_frame.word_wrap = True
-    
-    for i, point in enumerate(left_content):
-        if i == 0:
-            p = left_frame.paragraphs[0]
-        else:
-            p = left_frame.add_paragraph()
-        p.text = point
-        p.font.size = Pt(18)
-        p.font.color.rgb = color_scheme['text']
-        p.bullet = True
     
     # Right column
-    right_box = slide.shapes.add_textbox(
-        Inches(5.2), Inches(1.2),
-        Inches(4), Inches(5.5)
+    add_text_box(
+        slide, Inches(5.2), Inches(1.2), Inches(4), Inches(5.5),
+        content[mid_point:], color_scheme['styles']['column'], word_wrap=True
     )
-    right_frame = right_box.text_frame
-    right_frame.word_wrap = True
-    
-    for i, point in enumerate(right_content):
-        if i == 0:
-            p = right_frame.paragraphs[0]
-        else:
-            p = right_frame.add_paragraph()
-        p.text = point
-        p.font.size = Pt(18)
-        p.font.color.rgb = color_scheme['text']
-        p.bullet = True
 
 def add_numbered_content(slide, points, color_scheme):
     """Add numbered list content"""
-    content_box = slide.shapes.add_textbox(
-        Inches(0.7), Inches(1.2),
-        Inches(8.6), Inches(5.5)
+    add_text_box(
+        slide, Inches(0.7), Inches(1.2), Inches(8.6), Inches(5.5),
+        [f"{i+1}. {point}" for i, point in enumerate(points)],
+        color_scheme['styles']['numbered'], word_wrap=True
     )
-    text_frame = content_box.text_frame
-    text_frame.word_wrap = True
+
+def csv_rows(text):
+    return [row for row in csv.reader(StringIO(text)) if row]
+
+def parse_number(value):
+    """A CSV cell as a float; blank or non-numeric cells ("n/a", "—") become None, a gap"""
+    try:
+        number = float(value.replace(',', ''))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+def normalize_table(table):
+    """Table data as headers and rows; a "csv" string is parsed, its first
+    line being the header unless "headers" is given"""
+    if not isinstance(table, dict) or not isinstance(table.get('csv'), str):
+        return table
+    rows = csv_rows(table['csv'])
+    headers = table.get('headers')
+    if not isinstance(headers, list):
+        headers = rows.pop(0) if rows else []
+    normalized = {key: value for key, value in table.items() if key != 'csv'}
+    normalized.update(headers=headers, rows=rows)
+    return normalized
+
+def normalize_chart(chart):
+    """Chart data as categories and series; a "csv" string holds the categories
+    in its first column and one series per further column, named by its header"""
+    if not isinstance(chart, dict) or not isinstance(chart.get('csv'), str):
+        return chart
+    rows = csv_rows(chart['csv'])
+    header = rows.pop(0) if rows else []
+    normalized = {key: value for key, value in chart.items() if key != 'csv'}
+    normalized['categories'] = [row[0] for row in rows]
+    normalized['series'] = [
+        {'name': name, 'values': [parse_number(row[column]) if column < len(row) else None for row in rows]}
+        for column, name in enumerate(header[1:], 1)
+    ]
+    return normalized
+
+def mean_of_numbers(values):
+    numbers = [value for value in values if is_number(value)]
+    return sum(numbers) / len(numbers) if numbers else None
+
+def reduce_chart_points(chart_type, categories, series):
+    """Fit long series to the chart: bucket means, or the top pie slices plus "Other" """
+    if chart_type == 'pie':
+        limit = max(app.config['CHART_MAX_SLICES'], 2)
+        if len(categories) <= limit or not series:
+            return categories, series
+        first = series[0]['values']
+        sizes = [first[i] if i < len(first) and is_number(first[i]) else 0 for i in range(len(categories))]
+        order = sorted(range(len(categories)), key=lambda i: sizes[i], reverse=True)
+        keep, rest = sorted(order[:limit - 1]), order[limit - 1:]
+        reduced = []
+        for entry in series:
+            values = entry['values']
+            kept = [values[i] if i < len(values) else None for i in keep]
+            reduced.append({'name': entry['name'], 'values': kept + [sum(values[i] for i in rest if i < len(values) and is_number(values[i]))]})
+        return [categories[i] for i in keep] + ['Other'], reduced
     
-    for i, point in enumerate(points):
-        if i == 0:
-            p = text_frame.paragraphs[0]
-        else:
-            p = text_frame.add_paragraph()
-        
-        p.text = f"{i+1}. {point}"
-        p.font.size = Pt(20)
-        p.font.name = 'Calibri'
-        p.font.color.rgb = color_scheme['text']
-        p.space_after = Pt(12)
+    limit = max(app.config['CHART_MAX_POINTS'], 1)
+    if len(categories) <= limit:
+        return categories, series
+    bounds = [len(categories) * bucket // limit for bucket in range(limit + 1)]
+    buckets = list(zip(bounds, bounds[1:]))
+    labels = [
+        str(categories[start]) if end - start == 1 else f'{categories[start]} – {categories[end - 1]}'
+        for start, end in buckets
+    ]
+    reduced = [
+        {'name': entry['name'], 'values': [mean_of_numbers(entry['values'][start:end]) for start, end in buckets]}
+        for entry in series
+    ]
+    return labels, reduced
 
 def add_chart_slide(prs, title, chart_data, color_scheme):
     """Add a slide with a chart"""
-    slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    # Background and header (same as content slide)
-    background = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, prs.slide_height
-    )
-    background.fill.solid()
-    background.fill.fore_color.rgb = RGBColor(255, 255, 255)
-    background.line.fill.background()
-    
-    header = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, Inches(0.8)
-    )
-    header.fill.solid()
-    header.fill.fore_color.rgb = color_scheme['primary']
-    header.line.fill.background()
-    
-    # Title
-    title_box = slide.shapes.add_textbox(
-        Inches(0.5), Inches(0.15),
-        prs.slide_width - Inches(1), Inches(0.5)
-    )
-    title_frame = title_box.text_frame
-    title_frame.text = title
-    title_frame.paragraphs[0].font.size = Pt(32)
-    title_frame.paragraphs[0].font.bold = True
-    title_frame.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
+    slide = add_content_chrome_slide(prs, title, color_scheme)
+    chart_data = normalize_chart(chart_data)
     
     # Add chart
     chart_type_map = {
@@ -336,11 +1943,16 @@ def add_chart_slide(prs, title, chart_data, color_scheme):
     
     chart_type = chart_type_map.get(chart_data.get('type', 'column'), XL_CHART_TYPE.COLUMN_CLUSTERED)
     
-    # Prepare chart data
+    # Prepare chart data, downsampled so huge series stay readable (and fast)
+    categories, series_list = reduce_chart_points(
+        chart_data.get('type', 'column'),
+        chart_data.get('categories', ['Category 1', 'Category 2', 'Category 3']),
+        chart_data.get('series', [{'name': 'Series 1', 'values': [10, 20, 30]}])
+    )
     chart_data_obj = CategoryChartData()
-    chart_data_obj.categories = chart_data.get('categories', ['Category 1', 'Category 2', 'Category 3'])
+    chart_data_obj.categories = categories
     
-    for series in chart_data.get('series', [{'name': 'Series 1', 'values': [10, 20, 30]}]):
+    for series in series_list:
         chart_data_obj.add_series(series['name'], series['values'])
     
     # Add chart to slide
@@ -353,215 +1965,1074 @@ def add_chart_slide(prs, title, chart_data, color_scheme):
     chart.has_legend = True
     chart.legend.position = 2  # Right
     chart.legend.font.size = Pt(12)
+    
+    # Series (or pie slices) take the theme palette in turn
+    palette = color_scheme['palette']
+    plot = chart.plots[0]
+    if chart_type == XL_CHART_TYPE.PIE:
+        shapes = list(plot.series[0].points) if plot.series else []
+    else:
+        shapes = list(plot.series)
+    for index, shape in enumerate(shapes):
+        color = palette[index % len(palette)]
+        if chart_type == XL_CHART_TYPE.LINE:
+            shape.format.line.color.rgb = color
+        else:
+            shape.format.fill.solid()
+            shape.format.fill.fore_color.rgb = color
+
+def table_row_xml(values, width, style, height):
+    run_properties, cell_properties = style
+    cells = []
+    for value in (list(values) + [''] * width)[:width]:
+        text = XML_INVALID_RE.sub('', '' if value is None else str(value)).replace('\r\n', '\n')
+        paragraphs = ''.join(
+            f'<a:p><a:r>{run_properties}<a:t>{escape(line)}</a:t></a:r></a:p>'
+            for line in text.split('\n')
+        )
+        cells.append(f'<a:tc><a:txBody><a:bodyPr/><a:lstStyle/>{paragraphs}</a:txBody>{cell_properties}</a:tc>')
+    return f'<a:tr h="{height}">{"".join(cells)}</a:tr>'
 
 def add_table_slide(prs, title, table_data, color_scheme):
-    """Add a slide with a table"""
-    slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    # Background and header
-    background = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, prs.slide_height
-    )
-    background.fill.solid()
-    background.fill.fore_color.rgb = RGBColor(255, 255, 255)
-    background.line.fill.background()
-    
-    header = slide.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE,
-        0, 0,
-        prs.slide_width, Inches(0.8)
-    )
-    header.fill.solid()
-    header.fill.fore_color.rgb = color_scheme['primary']
-    header.line.fill.background()
+    """Add a slide with a table, continuing on further slides when it has more
+    rows than fit; rows are written as XML in one batch per slide"""
+    table_data = normalize_table(table_data)
+    headers = [str(header) for header in table_data.get('headers', [])]
+    rows = table_data.get('rows', [])
+    width = len(headers) or max((len(row) for row in rows if isinstance(row, list)), default=1)
+    per_slide = max(app.config['TABLE_ROWS_PER_SLIDE'], 1)
+    pages = [rows[start:start + per_slide] for start in range(0, len(rows), per_slide)] or [[]]
     
-    # Title
-    title_box = slide.shapes.add_textbox(
-        Inches(0.5), Inches(0.15),
-        prs.slide_width - Inches(1), Inches(0.5)
-    )
-    title_frame = title_box.text_frame
-    title_frame.text = title
-    title_frame.paragraphs[0].font.size = Pt(32)
-    title_frame.paragraphs[0].font.bold = True
-    title_frame.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
-    
-    # Add table
-    rows = len(table_data.get('rows', []))
-    cols = len(table_data.get('headers', []))
-    
-    left = Inches(1)
-    top = Inches(1.5)
-    width = Inches(8)
-    height = Inches(0.5) * (rows + 1)
-    
-    table = slide.shapes.add_table(rows + 1, cols, left, top, width, height).table
-    
-    # Set headers
-    for i, header in enumerate(table_data.get('headers', [])):
-        cell = table.rows[0].cells[i]
-        cell.text = header
-        cell.fill.solid()
-        cell.fill.fore_color.rgb = color_scheme['primary']
-        cell.text_frame.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
-        cell.text_frame.paragraphs[0].font.bold = True
-        cell.text_frame.paragraphs[0].font.size = Pt(14)
-    
-    # Set data
-    for row_idx, row_data in enumerate(table_data.get('rows', [])):
-        for col_idx, cell_value in enumerate(row_data):
-            cell = table.rows[row_idx + 1].cells[col_idx]
-            cell.text = str(cell_value)
-            cell.text_frame.paragraphs[0].font.size = Pt(12)
-            
-            # Alternate row colors
-            if row_idx % 2 == 1:
-                cell.fill.solid()
-                cell.fill.fore_color.rgb = color_scheme['light']
-
-def create_presentation(presentation_data):
-    """Create sophisticated PowerPoint presentation"""
-    prs = Presentation()
-    prs.slide_width = Inches(10)
-    prs.slide_height = Inches(7.5)
+    header_style = color_scheme['table']['header']
+    plain_style = color_scheme['table']['plain']
+    band_style = color_scheme['table']['band']
     
+    for page, page_rows in enumerate(pages):
+        page_title = f'{title} ({page + 1}/{len(pages)})' if len(pages) > 1 else title
+        slide = add_content_chrome_slide(prs, page_title, color_scheme)
+        
+        # Rows shrink from half an inch so a full page stays on the slide
+        row_height = min(Inches(0.5), (prs.slide_height - Inches(2)) // (len(page_rows) + 1))
+        table = slide.shapes.add_table(
+            1, width, Inches(1), Inches(1.5), Inches(8), row_height * (len(page_rows) + 1)
+        ).table
+        
+        row_xml = [table_row_xml(headers, width, header_style, row_height)]
+        for row_idx, row_data in enumerate(page_rows, page * per_slide):
+            style = band_style if row_idx % 2 == 1 else plain_style
+            row_xml.append(table_row_xml(row_data if isinstance(row_data, list) else [row_data], width, style, row_height))
+        
+        tbl = table._tbl
+        for tr in tbl.tr_lst:
+            tbl.remove(tr)
+        for tr in list(parse_xml(f'<a:tbl {nsdecls("a")}>{"".join(row_xml)}</a:tbl>')):
+            tbl.append(tr)
+
+def create_presentation(presentation_data, render_mode=None):
+    """Create sophisticated PowerPoint presentation
+
+    render_mode "master" starts from the cached themed template so slides
+    only add content shapes; "shapes" draws backgrounds and bars per slide.
+    """
+    with span('render', slides=len(presentation_data.get('slides', []))):
+        return build_presentation(presentation_data, render_mode or app.config['RENDER_MODE'])
+
+def build_presentation(presentation_data, render_mode):
+    """Build every slide of a deck with the given render mode"""
     # Select color scheme
     color_scheme_name = presentation_data.get('color_scheme', 'corporate_blue')
-    color_scheme = COLOR_SCHEMES.get(color_scheme_name, COLOR_SCHEMES['corporate_blue'])
+    if color_scheme_name not in THEMES:
+        color_scheme_name = 'corporate_blue'
+    color_scheme = get_theme(color_scheme_name)
+    
+    if render_mode == 'master':
+        prs = Presentation(BytesIO(get_theme_template(color_scheme_name)))
+    else:
+        prs = Presentation()
+        prs.slide_width = Inches(10)
+        prs.slide_height = Inches(7.5)
     
     # Title slide
-    add_styled_title_slide(
+    title = presentation_data.get('title', 'Presentation')
+    subtitle = presentation_data.get('subtitle', '')
+    render_cached(
         prs,
-        presentation_data.get('title', 'Presentation'),
-        presentation_data.get('subtitle', ''),
-        color_scheme
+        slide_cache_key({'title_slide': [title, subtitle]}, color_scheme_name, render_mode),
+        lambda: add_styled_title_slide(prs, title, subtitle, color_scheme)
     )
     
     # Content slides
     for slide_data in presentation_data.get('slides', []):
-        slide_type = slide_data.get('type', 'bullet')
-        
-        if slide_type == 'chart':
-            add_chart_slide(
-                prs,
-                slide_data.get('title', ''),
-                slide_data.get('chart_data', {}),
-                color_scheme
-            )
-        elif slide_type == 'table':
-            add_table_slide(
-                prs,
-                slide_data.get('title', ''),
-                slide_data.get('table_data', {}),
-                color_scheme
-            )
-        else:
-            layout_type = slide_data.get('layout', 'bullet')
-            add_content_slide(
-                prs,
-                slide_data.get('title', ''),
-                slide_data.get('points', []),
-                color_scheme,
-                layout_type
-            )
+        render_cached(
+            prs,
+            slide_cache_key(slide_data, color_scheme_name, render_mode),
+            lambda: add_slide_from_data(prs, slide_data, color_scheme)
+        )
     
     return prs
 
+def add_slide_from_data(prs, slide_data, color_scheme):
+    slide_type = slide_data.get('type', 'bullet')
+    
+    if slide_type == 'chart':
+        add_chart_slide(
+            prs,
+            slide_data.get('title', ''),
+            slide_data.get('chart_data', {}),
+            color_scheme
+        )
+    elif slide_type == 'table':
+        add_table_slide(
+            prs,
+            slide_data.get('title', ''),
+            slide_data.get('table_data', {}),
+            color_scheme
+        )
+    else:
+        layout_type = slide_data.get('layout', 'bullet')
+        add_content_slide(
+            prs,
+            slide_data.get('title', ''),
+            slide_data.get('points', []),
+            color_scheme,
+            layout_type
+        )
+
+def slide_cache_key(slide_data, color_scheme_name, render_mode):
+    if app.config['SLIDE_CACHE_SIZE'] <= 0:
+        return None
+    return sha256_text(json.dumps([slide_data, color_scheme_name, render_mode], sort_keys=True, ensure_ascii=False))
+
+def render_cached(prs, key, render):
+    """Copy the memoized slides for key into prs, or render() them and memoize them"""
+    if key is not None and restore_slides(prs, key):
+        metrics.inc('rag_slide_cache_total', result='hit')
+        return
+    rendered_from = len(prs.slides)
+    render()
+    if key is not None:
+        metrics.inc('rag_slide_cache_total', result='miss')
+        # One slide's data can fill several slides (long tables continue)
+        remember_slides(key, [prs.slides[index] for index in range(rendered_from, len(prs.slides))])
+
+def snapshot_slide(slide):
+    """A copy of a rendered slide's XML and of the chart parts it uses"""
+    charts = []
+    for rId, rel in slide.part.rels.items():
+        if rel.is_external or rel.reltype != RT.CHART:
+            continue
+        chart_part = rel.target_part
+        workbook = chart_part.chart_workbook.xlsx_part
+        chart = copy.deepcopy(chart_part._element)
+        chart._remove_externalData()
+        charts.append((rId, chart, workbook.blob if workbook is not None else None))
+    
+    return {
+        'layout': slide.slide_layout.name,
+        'cSld': copy.deepcopy(slide._element.cSld),
+        'charts': charts
+    }
+
+def remember_slides(key, slides):
+    entry = [snapshot_slide(slide) for slide in slides]
+    with slide_cache_lock:
+        slide_cache[key] = entry
+        while len(slide_cache) > app.config['SLIDE_CACHE_SIZE']:
+            slide_cache.popitem(last=False)
+
+def restore_slides(prs, key):
+    """Add copies of memoized slides to prs; False if there are none to use"""
+    with slide_cache_lock:
+        entry = slide_cache.get(key)
+        if entry is None:
+            return False
+        slide_cache.move_to_end(key)
+    layouts = [prs.slide_layouts.get_by_name(snapshot['layout']) for snapshot in entry]
+    if not entry or None in layouts:
+        return False
+    for layout, snapshot in zip(layouts, entry):
+        restore_slide(prs, layout, snapshot)
+    return True
+
+def restore_slide(prs, layout, entry):
+    slide = prs.slides.add_slide(layout)
+    content = copy.deepcopy(entry['cSld'])
+    slide._element.cSld.addprevious(content)
+    slide._element.remove(content.getnext())
+    
+    # Charts live in their own parts: add copies and point the frames at them
+    rIds = {}
+    package = slide.part.package
+    for old_rId, chart, workbook in entry['charts']:
+        chart_part = ChartPart(
+            package.next_partname(ChartPart.partname_template),
+            CT.DML_CHART,
+            package,
+            copy.deepcopy(chart)
+        )
+        if workbook is not None:
+            chart_part.chart_workbook.update_from_xlsx_blob(workbook)
+        rIds[old_rId] = slide.part.relate_to(chart_part, RT.CHART)
+    if rIds:
+        for element in content.iter(qn('c:chart')):
+            element.set(qn('r:id'), rIds[element.get(qn('r:id'))])
+    return slide
+
+REQUEST_ID_RE = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+@app.before_request
+def start_request_trace():
+    trace = new_trace(method=request.method, path=request.path)
+    request_id = request.headers.get('X-Request-ID', '')
+    if REQUEST_ID_RE.fullmatch(request_id):
+        trace['trace_id'] = request_id
+    current_trace.set(trace)
+    g.trace = trace
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if app.config['PROFILING_ENABLED'] and request.headers.get('X-Profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    started = g.request_started
+    profiler = g.profiler
+    endpoint = request.endpoint or 'unknown'
+    method = request.method
+    status = response.status_code
+    response.headers['X-Request-ID'] = trace['trace_id']
+    
+    # Streamed responses keep running after this hook, so finish on close
+    def finish():
+        elapsed = time.perf_counter() - started
+        metrics.observe('rag_http_request_duration_seconds', elapsed, endpoint=endpoint, method=method)
+        metrics.inc('rag_http_requests_total', endpoint=endpoint, method=method, status=status)
+        fields = {'status': status, 'duration_ms': round(elapsed * 1000, 2)}
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+            fields['profile'] = os.path.join(app.config['PROFILE_FOLDER'], f"{trace['trace_id']}.prof")
+            profiler.dump_stats(fields['profile'])
+        log_trace(trace, **fields)
+    
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    for name, value in get_ollama_client().stats().items():
+        metrics.set_gauge(f'rag_ollama_{name}', value)
+    for name, value in get_response_cache().stats().items():
+        metrics.set_gauge(f'rag_llm_cache_{name}', int(value))
+    for name in ('sessions', 'bytes'):
+        metrics.set_gauge(f'rag_session_{name}', get_session_store().stats()[name])
+    with jobs_lock:
+        for state in ('queued', 'running'):
+            metrics.set_gauge('rag_jobs', sum(1 for job in jobs.values() if job['state'] == state), state=state)
+    with index_lock:
+        cached = list(collections.items())
+    for tenant, collection in cached:
+        metrics.set_gauge('rag_index_chunks', collection.count(), tenant=tenant)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_documents():
-    global collection
+@app.route('/index/stats')
+def index_stats():
+    tenant = request.args.get('tenant', DEFAULT_TENANT)
+    if not valid_tenant(tenant):
+        return jsonify({'error': 'Invalid tenant'}), 400
+    collection = get_collection(tenant, create=False)
+    path = app.config['CHROMA_PATH']
+    persistent = bool(path) and not app.config['CHROMA_HOST']
+    
+    return jsonify({
+        'tenant': tenant,
+        'chunks': collection.count() if collection else 0,
+        'files': len(indexed_files(collection)) if collection else 0,
+        'persistent': persistent,
+        'path': path if persistent else None,
+        # The whole index directory: every tenant's collections share it
+        'store_disk_bytes': directory_size(path) if persistent else 0,
+        'load_seconds': index_load_seconds.get(tenant)
+    })
+
+@app.route('/collections')
+def list_collections():
+    tenants = []
+    for tenant in list_tenants():
+        collection = get_collection(tenant, create=False)
+        tenants.append({'tenant': tenant, 'chunks': collection.count() if collection else 0})
+    return jsonify({'collections': tenants})
+
+@app.route('/collections/<tenant>', methods=['DELETE'])
+def delete_collection(tenant):
+    if not valid_tenant(tenant):
+        return jsonify({'error': 'Invalid tenant'}), 400
+    if not delete_tenant(tenant):
+        return jsonify({'error': 'Collection not found'}), 404
+    return jsonify({'success': True, 'message': f'Deleted collection for {tenant}'})
+
+@app.route('/ollama/stats')
+def ollama_stats():
+    return jsonify(get_ollama_client().stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(get_response_cache().stats())
+
+@app.route('/sessions/stats')
+def session_stats():
+    return jsonify(get_session_store().stats())
+
+@app.route('/upload', methods=['POST'])
+def upload_documents():
+    if 'files' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    files = request.files.getlist('files')
+    
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+    
+    # "replace" treats the upload as the whole corpus and drops files that are
+    # no longer part of it; "append" only adds or updates the uploaded files.
+    mode = request.form.get('mode', 'replace')
+    if mode not in ('replace', 'append'):
+        return jsonify({'error': 'mode must be "replace" or "append"'}), 400
+    tenant = request.form.get('tenant') or DEFAULT_TENANT
+    if not valid_tenant(tenant):
+        return jsonify({'error': 'Invalid tenant'}), 400
+    
+    stored_files = []
+    try:
+        for file in files:
+            if file.filename == '':
+                continue
+            
+            filename = secure_filename(file.filename)
+            extension = os.path.splitext(filename)[1]
+            if extension not in EXTRACTORS:
+                continue
+            
+            with span('upload_save', file=filename):
+                file_hash, file_path = store_upload(file, extension)
+            stored_files.append((filename, file_hash, file_path))
+        
+        if request.form.get('async') in ('1', 'true'):
+            try:
+                job = submit_job('index', run_index_job, tenant, mode, stored_files)
+            except JobQueueFull as e:
+                return jsonify({'error': f'Server busy: {str(e)}'}), 503
+            # The job releases the stored files once they are indexed
+            stored_files = []
+            return job_accepted(job)
+        
+        return jsonify(index_stored_files(tenant, mode, stored_files))
+    finally:
+        release_stored(file_path for _, _, file_path in stored_files)
+
+def open_pages(file_path, group=None):
+    """Pages of a stored file from its sidecar, or its extraction, started now"""
+    pages = load_extracted_pages(file_path)
+    if pages is not None:
+        return pages, None
+    return None, submit_extraction(file_path, group)
+
+def index_stored_files(tenant, mode, files, progress=None):
+    """Index (filename, SHA-256, stored path) files into a tenant's collection.
+
+    progress, if given, is called with the fraction done and a message.
+    """
+    collection = get_collection(tenant)
+    indexed = indexed_files(collection)
+    
+    uploaded = set()
+    pending = []
+    unchanged_files = 0
+    cached_files = 0
+    removed_chunks = 0
+    updated_chunks = 0
+    
+    for filename, file_hash, file_path in files:
+        uploaded.add(filename)
+        previous = indexed.get(filename)
+        
+        if previous and previous['file_hash'] == file_hash:
+            unchanged_files += 1
+            continue
+        pending.append((filename, file_hash, previous, file_path))
+    
+    # Later files' pool extraction starts while this one is chunked and
+    # embedded: files are opened ahead until EXTRACTION_WORKERS ranges are
+    # queued (at most EXTRACTION_MAX_PENDING across them). Inline files are
+    # not read ahead, since starting them reads nothing. Chunks are embedded
+    # batch by batch while later pages are parsed.
+    batcher = EmbeddingBatcher(collection, app.config['EMBED_BATCH_SIZE'])
+    workers = max(app.config['EXTRACTION_WORKERS'], 1)
+    group = []
+    sources = []
+    
+    for index, (filename, file_hash, previous, file_path) in enumerate(pending):
+        while len(sources) < len(pending) and (
+                len(sources) <= index
+                or len(sources) - index <= workers and queued_ranges(group) < workers):
+            sources.append(open_pages(pending[len(sources)][3], group))
+        cached_pages, tasks = sources[index]
+        sources[index] = None
+        
+        timings = {}
+        # The same content uploaded before (under any name, by any tenant)
+        # has its text cached next to it and is not parsed again
+        if cached_pages is None:
+            metrics.inc('rag_extraction_cache_total', result='miss')
+            pages = iter_saving_pages(file_path, iter_extracted_pages(tasks, timings))
+        else:
+            metrics.inc('rag_extraction_cache_total', result='hit')
+            cached_files += 1
+            pages = cached_pages
+        
+        existing_ids = previous['ids'] if previous else set()
+        seen_ids = set()
+        kept_ids = []
+        kept_metadatas = []
+        
+        embed_seconds = batcher.seconds
+        started = time.perf_counter()
+        
+        for chunk in iter_chunks(pages):
+            chunk_hash = sha256_text(chunk['text'])
+            chunk_id = f"{filename}:{chunk_hash}"
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            
+            metadata = {
+                'source': filename,
+                'file_hash': file_hash,
+                'chunk_hash': chunk_hash,
+                'tokens': chunk['tokens'],
+                'page_start': chunk['page_start'],
+                'page_end': chunk['page_end'],
+                'char_start': chunk['start'],
+                'char_end': chunk['end']
+            }
+            
+            if chunk_id in existing_ids:
+                kept_ids.append(chunk_id)
+                kept_metadatas.append(metadata)
+            else:
+                batcher.add(chunk_id, chunk['text'], metadata)
+            
+            if progress and len(seen_ids) % 256 == 0:
+                fraction = tasks.fraction_done if tasks else 0.0
+                progress((index + fraction) / len(pending), f'Indexing {filename}: {len(seen_ids)} chunks')
+        
+        # Chunking is interleaved with waiting on extraction and embedding
+        # batches, so its span is what remains of the loop after both.
+        elapsed = time.perf_counter() - started
+        record_span('extract', timings.get('extract', 0.0), file=filename)
+        record_span('chunk', max(elapsed - timings.get('wait', 0.0) - (batcher.seconds - embed_seconds), 0.0),
+                    file=filename, chunks=len(seen_ids))
+        
+        stale_ids = list(existing_ids - seen_ids)
+        
+        if kept_ids:
+            collection.update(ids=kept_ids, metadatas=kept_metadatas)
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        
+        removed_chunks += len(stale_ids)
+        updated_chunks += len(kept_ids)
+        if progress:
+            progress((index + 1) / len(pending), f'Indexed {index + 1} of {len(pending)} files')
+    
+    batcher.flush()
+    added_chunks = batcher.added
+    
+    if mode == 'replace':
+        for source, entry in indexed.items():
+            if source not in uploaded:
+                collection.delete(ids=list(entry['ids']))
+                removed_chunks += len(entry['ids'])
+    
+    if added_chunks or removed_chunks or updated_chunks:
+        bump_index_version(tenant, collection)
+    prune_upload_store()
+    
+    return {
+        'success': True,
+        'tenant': tenant,
+        'message': f'Processed {len(uploaded)} files: {unchanged_files} unchanged, '
+                   f'{cached_files} read from the extraction cache, '
+                   f'{added_chunks} chunks embedded, {removed_chunks} removed, '
+                   f'{collection.count()} chunks indexed',
+        'unchanged_files': unchanged_files,
+        'cached_files': cached_files,
+        'added_chunks': added_chunks,
+        'removed_chunks': removed_chunks,
+        'total_chunks': collection.count()
+    }
+
+def run_index_job(job, tenant, mode, files, upload_ids=()):
+    """Assemble finalized part uploads into the store, then index every file;
+    the stored files are released afterwards"""
+    files = list(files)
+    try:
+        for number, upload_id in enumerate(upload_ids, 1):
+            update_job(job, message=f'Assembling upload {number} of {len(upload_ids)}')
+            files.append(assemble_upload(upload_id))
+        
+        def progress(fraction, message):
+            update_job(job, progress=round(fraction, 4), message=message)
+        
+        return index_stored_files(tenant, mode, files, progress)
+    finally:
+        release_stored(file_path for _, _, file_path in files)
+
+UPLOAD_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+def upload_session_dir(upload_id):
+    return os.path.join(app.config['UPLOAD_PARTS_FOLDER'], upload_id)
+
+def part_path(upload_id, number):
+    return os.path.join(upload_session_dir(upload_id), f'{number:06d}.part')
+
+def read_upload_session(upload_id):
+    """The metadata of a part upload, or None if there is no such upload"""
+    if not UPLOAD_ID_RE.fullmatch(upload_id):
+        return None
+    try:
+        with open(os.path.join(upload_session_dir(upload_id), 'upload.json'), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_upload_session(upload):
+    path = os.path.join(upload_session_dir(upload['upload_id']), 'upload.json')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        json.dump(upload, file)
+    os.replace(f'{path}.tmp', path)
+
+def upload_parts(upload_id):
+    """Sizes of the parts received so far, by part number"""
+    parts = {}
+    with os.scandir(upload_session_dir(upload_id)) as entries:
+        for entry in entries:
+            if entry.name.endswith('.part'):
+                parts[int(entry.name[:-len('.part')])] = entry.stat().st_size
+    return parts
+
+def prune_upload_sessions():
+    """Drop part uploads idle for longer than UPLOAD_SESSION_TTL_SECONDS"""
+    cutoff = time.time() - app.config['UPLOAD_SESSION_TTL_SECONDS']
+    try:
+        names = os.listdir(app.config['UPLOAD_PARTS_FOLDER'])
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(app.config['UPLOAD_PARTS_FOLDER'], name)
+        try:
+            idle = os.path.getmtime(path) < cutoff
+        except OSError:
+            continue
+        if idle:
+            shutil.rmtree(path, ignore_errors=True)
+
+def assemble_upload(upload_id):
+    """Concatenate a finalized upload's parts into the store and delete them;
+    returns its (filename, SHA-256, stored path)"""
+    upload = read_upload_session(upload_id)
+    if upload is None:
+        raise ValueError(f'Upload {upload_id} no longer exists')
+    numbers = sorted(upload_parts(upload_id))
+    
+    def blocks():
+        for number in numbers:
+            with open(part_path(upload_id, number), 'rb') as file:
+                yield from iter(lambda: file.read(1024 * 1024), b'')
+    
+    with span('upload_assemble', file=upload['filename'], parts=len(numbers)):
+        file_hash, file_path = store_blocks(blocks(), os.path.splitext(upload['filename'])[1])
+    shutil.rmtree(upload_session_dir(upload_id), ignore_errors=True)
+    return upload['filename'], file_hash, file_path
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload of one file, sent in numbered parts"""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    if os.path.splitext(filename)[1] not in EXTRACTORS:
+        return jsonify({'error': f"Unsupported file type, expected one of {', '.join(EXTRACTORS)}"}), 400
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+        return jsonify({'error': 'size must be a number of bytes'}), 400
+    if size is not None and size > app.config['UPLOAD_MAX_BYTES']:
+        return jsonify({'error': f"Files are limited to {app.config['UPLOAD_MAX_BYTES']} bytes"}), 413
+    
+    prune_upload_sessions()
+    upload = {
+        'upload_id': uuid.uuid4().hex,
+        'filename': filename,
+        'size': size,
+        'finalized': False,
+        'created': time.time()
+    }
+    os.makedirs(upload_session_dir(upload['upload_id']))
+    write_upload_session(upload)
+    return jsonify({
+        'upload_id': upload['upload_id'],
+        'status_url': f"/uploads/{upload['upload_id']}",
+        'part_max_bytes': app.config['UPLOAD_PART_MAX_BYTES']
+    }), 201
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    """The parts received so far, for resuming an interrupted upload"""
+    upload = read_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    parts = upload_parts(upload_id)
+    return jsonify(dict(
+        upload,
+        parts=[{'number': number, 'size': size} for number, size in sorted(parts.items())],
+        received_bytes=sum(parts.values())
+    ))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    upload = read_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload['finalized']:
+        return jsonify({'error': 'Upload is already being indexed'}), 409
+    shutil.rmtree(upload_session_dir(upload_id), ignore_errors=True)
+    return jsonify({'success': True})
+
+@app.route('/uploads/<upload_id>/parts/<int:number>', methods=['PUT'])
+def upload_part(upload_id, number):
+    """Stream one part of an upload to disk; sending a part again replaces it"""
+    upload = read_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload['finalized']:
+        return jsonify({'error': 'Upload is already being indexed'}), 409
+    if number < 1:
+        return jsonify({'error': 'Parts are numbered from 1'}), 400
     
-    if 'files' not in request.files:
-        return jsonify({'error': 'No files provided'}), 400
+    request.max_content_length = app.config['UPLOAD_PART_MAX_BYTES']
+    received = sum(size for other, size in upload_parts(upload_id).items() if other != number)
+    limit = app.config['UPLOAD_MAX_BYTES'] if upload['size'] is None else upload['size']
     
-    files = request.files.getlist('files')
+    path = part_path(upload_id, number)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as file:
+            for block in iter(lambda: request.stream.read(1024 * 1024), b''):
+                size += len(block)
+                if received + size > limit:
+                    return jsonify({'error': f'Upload exceeds its {limit} bytes'}), 413
+                digest.update(block)
+                file.write(block)
+        
+        # Clients may send the part's SHA-256 so corrupted parts are refused
+        expected = request.headers.get('X-Content-SHA256')
+        if expected and expected.lower() != digest.hexdigest():
+            return jsonify({'error': 'Part does not match X-Content-SHA256'}), 400
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
     
-    if not files:
-        return jsonify({'error': 'No files selected'}), 400
+    return jsonify({'number': number, 'size': size, 'sha256': digest.hexdigest()})
+
+@app.route('/uploads/finalize', methods=['POST'])
+def finalize_uploads():
+    """Index complete part uploads in a background job"""
+    data = request.get_json(silent=True) or {}
+    upload_ids = data.get('upload_ids')
+    if not isinstance(upload_ids, list) or not upload_ids or not all(isinstance(upload_id, str) for upload_id in upload_ids):
+        return jsonify({'error': 'upload_ids must be a list of upload ids'}), 400
+    # Part uploads add to the index by default; "replace" drops every
+    # indexed file that is not among these uploads
+    mode = data.get('mode', 'append')
+    if mode not in ('append', 'replace'):
+        return jsonify({'error': 'mode must be "append" or "replace"'}), 400
+    tenant = data.get('tenant') or DEFAULT_TENANT
+    if not valid_tenant(tenant):
+        return jsonify({'error': 'Invalid tenant'}), 400
     
+    uploads = []
+    for upload_id in dict.fromkeys(upload_ids):
+        upload = read_upload_session(upload_id)
+        if upload is None:
+            return jsonify({'error': f'Upload {upload_id} not found'}), 404
+        if upload['finalized']:
+            return jsonify({'error': f'Upload {upload_id} is already being indexed'}), 409
+        parts = upload_parts(upload_id)
+        if sorted(parts) != list(range(1, len(parts) + 1)):
+            return jsonify({'error': f'Upload {upload_id} is missing parts'}), 400
+        if upload['size'] is not None and sum(parts.values()) != upload['size']:
+            return jsonify({'error': f"Upload {upload_id} has {sum(parts.values())} of {upload['size']} bytes"}), 400
+        uploads.append(upload)
+    
+    for upload in uploads:
+        write_upload_session(dict(upload, finalized=True))
     try:
-        chroma_client.delete_collection(name="documents")
-    except:
-        pass
+        job = submit_job('index', run_index_job, tenant, mode, [], [upload['upload_id'] for upload in uploads])
+    except JobQueueFull as e:
+        for upload in uploads:
+            write_upload_session(upload)
+        return jsonify({'error': f'Server busy: {str(e)}'}), 503
+    return job_accepted(job)
+
+class JobQueueFull(Exception):
+    pass
+
+def get_job_executor():
+    global job_executor
+    if job_executor is None:
+        job_executor = ThreadPoolExecutor(
+            max_workers=app.config['JOB_WORKERS'],
+            thread_name_prefix='job'
+        )
+    return job_executor
+
+def prune_jobs():
+    """Forget finished jobs older than JOB_TTL_SECONDS"""
+    cutoff = time.time() - app.config['JOB_TTL_SECONDS']
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items()
+                       if job['state'] in ('done', 'failed') and job['updated'] < cutoff]:
+            del jobs[job_id]
+
+def submit_job(kind, func, *args):
+    """Queue func(job, *args) on the worker pool and return the job record"""
+    prune_jobs()
+    with jobs_lock:
+        active = sum(1 for job in jobs.values() if job['state'] in ('queued', 'running'))
+        if active >= app.config['JOB_QUEUE_LIMIT']:
+            raise JobQueueFull(f'{active} jobs already pending')
+        now = time.time()
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'state': 'queued',
+            'progress': 0.0,
+            'message': 'Queued',
+            'result': None,
+            'result_url': None,
+            'error': None,
+            'created': now,
+            'updated': now
+        }
+        jobs[job['id']] = job
+    get_job_executor().submit(run_job, job, func, args)
+    return job
+
+def run_job(job, func, args):
+    trace = new_trace(job_id=job['id'], kind=job['kind'])
+    current_trace.set(trace)
+    started = time.perf_counter()
+    metrics.observe('rag_job_queue_seconds', time.time() - job['created'], kind=job['kind'])
+    update_job(job, state='running', message='Running')
+    try:
+        result = func(job, *args)
+        update_job(job, state='done', progress=1.0, message='Done', result=result)
+    except Exception as e:
+        update_job(job, state='failed', message='Failed', error=str(e))
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('rag_job_duration_seconds', elapsed, kind=job['kind'], state=job['state'])
+        log_trace(trace, state=job['state'], duration_ms=round(elapsed * 1000, 2))
+
+def update_job(job, **fields):
+    with jobs_lock:
+        job.update(fields)
+        job['updated'] = time.time()
+
+def job_accepted(job):
+    """202 response pointing the client at the job's status URL"""
+    status_url = f"/jobs/{job['id']}"
+    response = jsonify({'job_id': job['id'], 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(dict(job))
+
+FALLBACK_STRUCTURE = {
+    "title": "Generated Presentation",
+    "subtitle": "Based on your request",
+    "color_scheme": "corporate_blue",
+    "slides": [
+        {
+            "type": "bullet",
+            "layout": "bullet",
+            "title": "Overview",
+            "points": ["Point 1", "Point 2", "Point 3"]
+        }
+    ]
+}
+
+TERM_RE = re.compile(r"[^\W_]{2,}")
+
+class BM25Index:
+    """Okapi BM25 over a collection's chunks, held in memory"""
     
-    collection = chroma_client.create_collection(
-        name="documents",
-        metadata={"hnsw:space": "cosine"}
-    )
+    def __init__(self, ids, documents, metadatas, k1=1.5, b=0.75):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = []
+        for position, document in enumerate(documents):
+            terms = TERM_RE.findall(document.lower())
+            self.lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, []).append((position, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
     
-    all_chunks = []
-    chunk_ids = []
+    @classmethod
+    def from_collection(cls, collection):
+        records = collection.get(include=['documents', 'metadatas'])
+        return cls(records['ids'], records['documents'], [metadata or {} for metadata in records['metadatas']])
     
-    for file in files:
-        if file.filename == '':
+    def search(self, query, n_results):
+        """Positions of the best-scoring chunks, best first"""
+        scores = {}
+        total = len(self.lengths)
+        for term in set(TERM_RE.findall(query.lower())):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / (self.average_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+def index_version(tenant):
+    """The version stamp of a tenant's chunks, as last written by any worker"""
+    try:
+        collection = get_chroma_client().get_collection(name=collection_name(tenant))
+    except (chromadb.errors.NotFoundError, ValueError):
+        return None
+    return (collection.metadata or {}).get('index_version')
+
+def bump_index_version(tenant, collection):
+    """Mark a tenant's chunks as changed so every worker rebuilds its BM25 index"""
+    metadata = {key: value for key, value in (collection.metadata or {}).items() if not key.startswith('hnsw:')}
+    metadata['index_version'] = uuid.uuid4().hex
+    collection.modify(metadata=metadata)
+    schedule_keyword_index(tenant)
+
+def get_keyword_index(tenant):
+    """The tenant's BM25 index if it matches the current chunks, else None
+    while a rebuild runs on the job pool"""
+    version = index_version(tenant)
+    with keyword_lock:
+        entry = keyword_indexes.get(tenant)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    schedule_keyword_index(tenant)
+    return None
+
+def schedule_keyword_index(tenant):
+    with keyword_lock:
+        if tenant in keyword_rebuilds:
+            return
+        keyword_rebuilds.add(tenant)
+    get_job_executor().submit(rebuild_keyword_index, tenant)
+
+def rebuild_keyword_index(tenant):
+    try:
+        collection = get_collection(tenant, create=False)
+        if collection is None:
+            return
+        # Read first: chunks written during the build leave it stale, not current
+        version = index_version(tenant)
+        with span('keyword_index', tenant=tenant):
+            index = BM25Index.from_collection(collection)
+        with keyword_lock:
+            keyword_indexes[tenant] = (version, index)
+    except Exception:
+        logger.exception('Rebuilding the keyword index of %s failed', tenant)
+    finally:
+        with keyword_lock:
+            keyword_rebuilds.discard(tenant)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked id lists; ids ranked well by several retrievers rise to the top"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def pack_context(chunk_ids, documents, metadatas, max_chunks, token_budget):
+    """Take chunks in rank order, skipping duplicates, until the budget is spent"""
+    packed = []
+    seen = set()
+    used = 0
+    for chunk_id in chunk_ids:
+        if len(packed) >= max_chunks:
+            break
+        document = documents[chunk_id]
+        fingerprint = sha256_text(' '.join(document.lower().split()))
+        if fingerprint in seen:
             continue
-        
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        if filename.endswith('.pdf'):
-            text = extract_text_from_pdf(file_path)
-        elif filename.endswith('.docx'):
-            text = extract_text_from_docx(file_path)
-        elif filename.endswith('.txt'):
-            text = extract_text_from_txt(file_path)
-        else:
+        tokens = metadatas[chunk_id].get('tokens') or count_tokens(document)
+        if packed and used + tokens > token_budget:
             continue
-        
-        chunks = chunk_text(text)
-        all_chunks.extend(chunks)
-        chunk_ids.extend([f"{filename}_{i}" for i in range(len(chunks))])
-    
-    if all_chunks:
-        collection.add(
-            documents=all_chunks,
-            ids=chunk_ids
-        )
-    
-    return jsonify({
-        'success': True,
-        'message': f'Processed {len(files)} files with {len(all_chunks)} chunks'
-    })
+        seen.add(fingerprint)
+        packed.append(document)
+        used += tokens
+    return packed, used
 
-@app.route('/generate_presentation', methods=['POST'])
-def generate_presentation():
-    data = request.json
-    user_request = data.get('request', '')
-    session_id = data.get('session_id', str(uuid.uuid4()))
-    
-    if not user_request:
-        return jsonify({'error': 'No request provided'}), 400
-    
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'history': [],
-            'iterations': 0
-        }
+def retrieve_context(user_request, n_results=5, tenant=DEFAULT_TENANT, token_budget=None):
+    """Fetch the most relevant chunks from the tenant's documents.
+
+    Vector and BM25 candidates are fused by reciprocal rank, then packed into
+    the token budget without duplicates.
+    """
+    collection = get_collection(tenant, create=False)
+    if collection is None or collection.count() == 0:
+        return ""
+    token_budget = token_budget or app.config['CONTEXT_TOKEN_BUDGET']
+    candidates = max(app.config['RETRIEVAL_CANDIDATES'], n_results)
+    embed = get_embedding_function()
     
-    context = ""
-    if collection:
+    with span('retrieve', n_results=n_results) as attributes:
+        query = {'query_embeddings': embed([user_request])} if embed else {'query_texts': [user_request]}
         results = collection.query(
-            query_texts=[user_request],
-            n_results=5
+            n_results=min(candidates, collection.count()),
+            include=['documents', 'metadatas'],
+            **query
         )
-        if results['documents']:
-            context = "\n\n".join(results['documents'][0])
-    
-    previous_context = ""
-    if sessions[session_id]['history']:
-        previous_context = "\n\nPrevious presentation attempts:\n"
-        for i, hist in enumerate(sessions[session_id]['history'], 1):
-            previous_context += f"\nAttempt {i}:\n{json.dumps(hist['structure'], indent=2)}\n"
-            previous_context += f"User feedback: {hist['feedback']}\n"
-    
-    prompt = f"""Based on the following context and user request, create a SOPHISTICATED PowerPoint presentation structure.
+        rankings = [results['ids'][0]]
+        documents = dict(zip(results['ids'][0], results['documents'][0]))
+        metadatas = {chunk_id: metadata or {} for chunk_id, metadata in zip(results['ids'][0], results['metadatas'][0])}
+        
+        # Until the tenant's keyword index is current, retrieval is vector-only
+        index = get_keyword_index(tenant) if app.config['HYBRID_RETRIEVAL'] else None
+        if index is not None:
+            positions = index.search(user_request, candidates)
+            rankings.append([index.ids[position] for position in positions])
+            for position in positions:
+                documents.setdefault(index.ids[position], index.documents[position])
+                metadatas.setdefault(index.ids[position], index.metadatas[position])
+        
+        packed, tokens = pack_context(reciprocal_rank_fusion(rankings), documents, metadatas, n_results, token_budget)
+        attributes.update(candidates=len(documents), chunks=len(packed), tokens=tokens)
+    return "\n\n".join(packed)
+
+def clip(text, limit=60):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+def list_field(data, key):
+    value = data.get(key) if isinstance(data, dict) else None
+    return value if isinstance(value, list) else []
+
+def structure_slides(structure):
+    """The slides of a structure, skipping entries that are not objects"""
+    return [slide for slide in list_field(structure, 'slides') if isinstance(slide, dict)]
+
+def slide_gist(slide):
+    """A few words describing a slide's content"""
+    slide_type = slide.get('type', 'bullet')
+    if slide_type == 'chart':
+        chart = normalize_chart(slide.get('chart_data', {}))
+        names = ', '.join(clip(series.get('name', ''), 20)
+                          for series in list_field(chart, 'series') if isinstance(series, dict))
+        chart_type = chart.get('type', 'column') if isinstance(chart, dict) else 'column'
+        return f"{chart_type} chart of {names} over {len(list_field(chart, 'categories'))} categories"
+    if slide_type == 'table':
+        table = normalize_table(slide.get('table_data', {}))
+        headers = ', '.join(clip(h, 20) for h in list_field(table, 'headers'))
+        return f"table ({headers}) x {len(list_field(table, 'rows'))} rows"
+    return '; '.join(clip(point, 40) for point in list_field(slide, 'points')[:3])
+
+def summarize_structure(structure):
+    """Compact outline of a deck: one line per slide instead of the full JSON"""
+    structure = structure if isinstance(structure, dict) else {}
+    lines = [f"Title: {clip(structure.get('title', ''))} | {structure.get('color_scheme', 'corporate_blue')}"]
+    for i, slide in enumerate(structure_slides(structure), 1):
+        lines.append(f"{i}. [{slide.get('type', 'bullet')}] {clip(slide.get('title', ''))} - {slide_gist(slide)}")
+    return "\n".join(lines)
+
+def diff_structures(old, new):
+    """Describe what changed between two attempts, slide by slide"""
+    if not old:
+        return f"first draft with {len(structure_slides(new))} slides"
+    changes = []
+    for key in ('title', 'subtitle', 'color_scheme'):
+        if old.get(key) != new.get(key):
+            changes.append(f"{key} -> {clip(new.get(key, ''))}")
+    old_slides = structure_slides(old)
+    new_slides = structure_slides(new)
+    for i in range(max(len(old_slides), len(new_slides))):
+        if i >= len(old_slides):
+            changes.append(f"added slide {i + 1} '{clip(new_slides[i].get('title', ''), 40)}'")
+        elif i >= len(new_slides):
+            changes.append(f"removed slide {i + 1} '{clip(old_slides[i].get('title', ''), 40)}'")
+        elif old_slides[i] != new_slides[i]:
+            changes.append(f"rewrote slide {i + 1} '{clip(new_slides[i].get('title', ''), 40)}'")
+    return '; '.join(changes) or 'no changes'
+
+def record_feedback(session, structure, feedback):
+    """Append a compact history entry; only the latest structure is kept whole.
+
+    Slides that are not objects are dropped so later prompts can summarise it.
+    """
+    structure = dict(structure or {})
+    if 'slides' in structure:
+        structure['slides'] = structure_slides(structure)
+    session['attempts'] += 1
+    session['history'].append({
+        'attempt': session['attempts'],
+        'changes': diff_structures(session['last_structure'], structure),
+        'feedback': feedback
+    })
+    del session['history'][:-app.config['SESSION_HISTORY_LIMIT']]
+    session['last_structure'] = structure
+
+def build_previous_context(session):
+    """Summarise earlier attempts and feedback for the prompt"""
+    if not session['history']:
+        return ""
+    previous_context = "\n\nPrevious presentation attempts:\n"
+    for hist in session['history']:
+        previous_context += f"\nAttempt {hist['attempt']}: {hist['changes']}\n"
+        previous_context += f"User feedback: {hist['feedback']}\n"
+    previous_context += f"\nOutline of the latest attempt:\n{summarize_structure(session['last_structure'])}\n"
+    return previous_context
+
+def build_presentation_prompt(user_request, context, previous_context):
+    return f"""Based on the following context and user request, create a SOPHISTICATED PowerPoint presentation structure.
 
 Context from documents:
 {context}
@@ -575,7 +3046,7 @@ Create a JSON structure with the following features:
 - Include professional layouts
 - For chart slides, provide chart data with categories and series
 - For table slides, provide headers and rows
-- Choose a color scheme: "corporate_blue", "modern_green", or "elegant_purple"
+- Choose a color scheme: {color_scheme_choices()}
 
 JSON format:
 {{
@@ -612,35 +3083,481 @@ JSON format:
 }}
 
 Provide ONLY valid JSON, no additional text."""
+
+def parse_presentation_response(response):
+    """Extract the deck JSON from a model response, or None if it is unusable.
+
+    A truncated or malformed deck still yields every slide object that closed.
+    """
+    with span('parse') as attributes:
+        text = CODE_FENCE_RE.sub('', response or '')
+        start_idx = text.find('{')
+        end_idx = text.rfind('}') + 1
+        if start_idx != -1:
+            try:
+                return loads_tolerant(text[start_idx:end_idx])
+            except ValueError:
+                pass
+        
+        parser = SlideStreamParser()
+        parser.feed(text)
+        if parser.slides:
+            attributes['recovered_slides'] = len(parser.slides)
+            return parser.structure()
+        attributes['failed'] = True
+        return None
+
+CHART_TYPES = ('bar', 'column', 'line', 'pie')
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_chart(chart):
+    if not isinstance(chart, dict):
+        return ['"chart_data" must be an object']
+    chart = normalize_chart(chart)
+    problems = []
+    if chart.get('type', 'column') not in CHART_TYPES:
+        problems.append(f'chart "type" must be one of {", ".join(CHART_TYPES)}')
+    categories = chart.get('categories')
+    if not isinstance(categories, list) or not categories:
+        problems.append('"categories" must be a non-empty list')
+        categories = None
+    series = chart.get('series')
+    if not isinstance(series, list) or not series:
+        return problems + ['"series" must be a non-empty list']
+    for number, entry in enumerate(series, 1):
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+            problems.append(f'series {number} needs a "name"')
+            continue
+        values = entry.get('values')
+        if not isinstance(values, list) or not all(is_number(value) for value in values):
+            problems.append(f'series {number} "values" must be a list of numbers')
+        elif categories and len(values) != len(categories):
+            problems.append(f'series {number} has {len(values)} values for {len(categories)} categories')
+    return problems
+
+def validate_table(table):
+    if not isinstance(table, dict):
+        return ['"table_data" must be an object']
+    table = normalize_table(table)
+    problems = []
+    headers = table.get('headers')
+    if not isinstance(headers, list) or not headers:
+        problems.append('"headers" must be a non-empty list')
+        headers = None
+    rows = table.get('rows')
+    if not isinstance(rows, list) or not rows:
+        return problems + ['"rows" must be a non-empty list']
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, list):
+            problems.append(f'row {number} must be a list')
+        elif headers and len(row) != len(headers):
+            problems.append(f'row {number} has {len(row)} cells for {len(headers)} headers')
+    return problems
+
+def validate_slide(slide):
+    """Problems that would stop a slide rendering properly; empty when it is valid"""
+    if not isinstance(slide, dict):
+        return ['slide is not a JSON object']
+    problems = []
+    if not isinstance(slide.get('title'), str) or not slide['title'].strip():
+        problems.append('missing "title"')
+    slide_type = slide.get('type', 'bullet')
+    if slide_type == 'chart':
+        problems += validate_chart(slide.get('chart_data'))
+    elif slide_type == 'table':
+        problems += validate_table(slide.get('table_data'))
+    elif slide_type in ('bullet', 'two_column', 'numbered'):
+        points = slide.get('points')
+        if not isinstance(points, list) or not points:
+            problems.append('"points" must be a non-empty list')
+        elif not all(isinstance(point, str) or is_number(point) for point in points):
+            problems.append('every point must be text')
+    else:
+        problems.append(f'unknown slide type "{slide_type}"')
+    return problems
+
+def coerce_slide(slide):
+    """Last resort for a slide the model could not fix: trim or pad its data to
+    fit, or fall back to a placeholder with its title"""
+    slide = json.loads(json.dumps(slide))
+    if slide.get('type') == 'table':
+        slide['table_data'] = normalize_table(slide.get('table_data'))
+    if slide.get('type') == 'chart':
+        slide['chart_data'] = normalize_chart(slide.get('chart_data'))
+    table = slide.get('table_data')
+    if slide.get('type') == 'table' and isinstance(table, dict) and isinstance(table.get('headers'), list):
+        width = len(table['headers'])
+        table['headers'] = [str(header) for header in table['headers']]
+        table['rows'] = [(list(row) + [''] * width)[:width] for row in table.get('rows') or [] if isinstance(row, list)]
+    chart = slide.get('chart_data')
+    if slide.get('type') == 'chart' and isinstance(chart, dict) and isinstance(chart.get('categories'), list):
+        width = len(chart['categories'])
+        for entry in chart.get('series') or []:
+            if isinstance(entry, dict) and isinstance(entry.get('values'), list):
+                values = [value if is_number(value) else 0 for value in entry['values']]
+                entry['values'] = (values + [0] * width)[:width]
+    if validate_slide(slide):
+        return placeholder_slide(slide)
+    return slide
+
+SLIDE_TYPES = ('bullet', 'two_column', 'numbered', 'chart', 'table')
+
+SLIDE_SCHEMAS = {
+    'bullet': '{"type": "bullet", "layout": "bullet", "title": "Slide title", "points": ["Point 1", "Point 2", "Point 3"]}',
+    'two_column': '{"type": "bullet", "layout": "two_column", "title": "Slide title", "points": ["Left 1", "Left 2", "Right 1", "Right 2"]}',
+    'numbered': '{"type": "bullet", "layout": "numbered", "title": "Slide title", "points": ["Step 1", "Step 2", "Step 3"]}',
+    'chart': '{"type": "chart", "title": "Chart title", "chart_data": {"type": "column", "categories": ["Q1", "Q2", "Q3"], "series": [{"name": "Sales", "values": [100, 150, 200]}]}}',
+    'table': '{"type": "table", "title": "Table title", "table_data": {"headers": ["Column 1", "Column 2"], "rows": [["Data 1", "Data 2"], ["Data 3", "Data 4"]]}}'
+}
+
+def build_outline_prompt(user_request, context, previous_context):
+    return f"""Based on the following context and user request, plan the OUTLINE of a PowerPoint presentation.
+
+Context from documents:
+{context}
+
+{previous_context}
+
+User request: {user_request}
+
+For each slide give only its title, its type ("bullet", "two_column", "numbered", "chart" or "table")
+and one sentence describing what it should cover. Choose a color scheme: {color_scheme_choices()}.
+
+JSON format:
+{{
+    "title": "Main presentation title",
+    "subtitle": "Subtitle",
+    "color_scheme": "corporate_blue",
+    "slides": [
+        {{"title": "Slide title", "type": "bullet", "focus": "What this slide covers"}}
+    ]
+}}
+
+Provide ONLY valid JSON, no additional text."""
+
+def build_slide_prompt(user_request, outline, index, context):
+    entry = outline['slides'][index]
+    slide_type = entry.get('type') if entry.get('type') in SLIDE_SCHEMAS else 'bullet'
+    titles = "\n".join(f"{i + 1}. {slide.get('title', '')}" for i, slide in enumerate(outline['slides']))
+    return f"""You are writing ONE slide of the presentation "{outline.get('title', '')}".
+
+Context from documents:
+{context}
+
+User request: {user_request}
+
+Full outline:
+{titles}
+
+Write slide {index + 1}: "{entry.get('title', '')}"
+It should cover: {entry.get('focus', entry.get('title', ''))}
+
+JSON format:
+{SLIDE_SCHEMAS[slide_type]}
+
+Provide ONLY valid JSON for this single slide, no additional text."""
+
+def placeholder_slide(entry):
+    return {
+        "type": "bullet",
+        "layout": "bullet",
+        "title": entry.get('title', 'Slide'),
+        "points": [entry.get('focus') or "Content to be added"]
+    }
+
+def build_repair_prompt(slide, problems):
+    slide_type = slide.get('type', 'bullet')
+    if slide_type == 'bullet' and slide.get('layout') in SLIDE_SCHEMAS:
+        slide_type = slide['layout']
+    schema = SLIDE_SCHEMAS.get(slide_type, SLIDE_SCHEMAS['bullet'])
+    issues = "\n".join(f"- {problem}" for problem in problems)
+    return f"""This presentation slide is invalid:
+{json.dumps(slide, ensure_ascii=False)}
+
+Problems:
+{issues}
+
+Rewrite the slide so that every problem is fixed, keeping its title and content.
+
+JSON format:
+{schema}
+
+Provide ONLY valid JSON for this single slide, no additional text."""
+
+def repair_slide(slide, problems, fresh=False):
+    """Re-ask the model for one invalid slide, then fix it locally if still invalid"""
+    for _ in range(app.config['SLIDE_RETRIES']):
+        prompt = build_repair_prompt(slide, problems)
+        repaired = parse_presentation_response(query_ollama(prompt, use_cache=not fresh))
+        same_type = isinstance(repaired, dict) and repaired.get('type', 'bullet') == slide.get('type', 'bullet')
+        if same_type and not validate_slide(repaired):
+            metrics.inc('rag_slide_repairs_total', outcome='model')
+            return repaired
+        get_response_cache().discard(response_cache_key(prompt))
+    metrics.inc('rag_slide_repairs_total', outcome='local')
+    return coerce_slide(slide)
+
+def repair_structure(structure, fresh=False):
+    """Validate every slide and re-ask the model only for the invalid ones"""
+    slides = structure.get('slides')
+    slides = [slide for slide in slides if isinstance(slide, dict)] if isinstance(slides, list) else []
+    invalid = {}
+    for index, slide in enumerate(slides):
+        problems = validate_slide(slide)
+        if problems:
+            invalid[index] = problems
     
-    response = query_ollama(prompt, context)
-    
-    try:
-        start_idx = response.find('{')
-        end_idx = response.rfind('}') + 1
-        json_str = response[start_idx:end_idx]
-        presentation_structure = json.loads(json_str)
-    except:
-        presentation_structure = {
-            "title": "Generated Presentation",
-            "subtitle": "Based on your request",
-            "color_scheme": "corporate_blue",
-            "slides": [
-                {
-                    "type": "bullet",
-                    "layout": "bullet",
-                    "title": "Overview",
-                    "points": ["Point 1", "Point 2", "Point 3"]
+    if invalid:
+        with span('repair', slides=len(invalid)):
+            with ThreadPoolExecutor(max_workers=app.config['SLIDE_PARALLELISM'], thread_name_prefix='repair') as executor:
+                futures = {
+                    executor.submit(contextvars.copy_context().run, repair_slide, slides[index], problems, fresh): index
+                    for index, problems in invalid.items()
                 }
-            ]
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        slides[index] = future.result()
+                    except Exception:
+                        slides[index] = coerce_slide(slides[index])
+    
+    structure['slides'] = slides
+    return structure
+
+def generate_slide(user_request, outline, index, fresh=False, tenant=DEFAULT_TENANT):
+    """Generate one slide with its own focused context, retrying only this slide"""
+    entry = outline['slides'][index]
+    context = retrieve_context(
+        f"{entry.get('title', '')} {entry.get('focus', '')} {user_request}",
+        n_results=app.config['SLIDE_CONTEXT_RESULTS'],
+        tenant=tenant,
+        token_budget=app.config['SLIDE_CONTEXT_TOKEN_BUDGET']
+    )
+    prompt = build_slide_prompt(user_request, outline, index, context)
+    
+    slide = None
+    for attempt in range(app.config['SLIDE_RETRIES'] + 1):
+        response = query_ollama(prompt, use_cache=not fresh and attempt == 0)
+        slide = parse_presentation_response(response)
+        if not validate_slide(slide):
+            return slide
+        get_response_cache().discard(response_cache_key(prompt))
+        if isinstance(slide, dict):
+            # A slide with fixable flaws is repaired rather than written again
+            return repair_slide(slide, validate_slide(slide), fresh)
+    
+    return placeholder_slide(entry)
+
+def iter_parallel_generation(user_request, session, fresh=False):
+    """Outline the deck, then fan out per-slide calls.
+
+    Yields ('outline', outline) once, then ('slide', index, slide) in
+    completion order.
+    """
+    context = retrieve_context(user_request, tenant=session['tenant'])
+    prompt = build_outline_prompt(user_request, context, build_previous_context(session))
+    
+    outline = parse_presentation_response(query_ollama(prompt, use_cache=not fresh))
+    if not isinstance(outline, dict) or not outline.get('slides'):
+        get_response_cache().discard(response_cache_key(prompt))
+        outline = parse_presentation_response(query_ollama(prompt, use_cache=False))
+    if not isinstance(outline, dict) or not outline.get('slides'):
+        outline = dict(FALLBACK_STRUCTURE)
+    outline['slides'] = [slide for slide in outline['slides'] if isinstance(slide, dict)]
+    
+    yield ('outline', outline)
+    
+    with ThreadPoolExecutor(max_workers=app.config['SLIDE_PARALLELISM'], thread_name_prefix='slide') as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, generate_slide,
+                            user_request, outline, index, fresh, session['tenant']): index
+            for index in range(len(outline['slides']))
         }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                slide = future.result()
+            except Exception:
+                slide = placeholder_slide(outline['slides'][index])
+            yield ('slide', index, slide)
+
+def assemble_structure(outline, slides):
+    return {
+        'title': outline.get('title', 'Generated Presentation'),
+        'subtitle': outline.get('subtitle', ''),
+        'color_scheme': outline.get('color_scheme', 'corporate_blue'),
+        'slides': [slides[index] for index in sorted(slides)]
+    }
+
+def get_session(session_id):
+    store = get_session_store()
+    return store.get(session_id) or store.create(session_id)
+
+def finish_iteration(session_id, session):
+    session['iterations'] += 1
+    get_session_store().save(session_id, session)
+    return session['iterations']
+
+@app.route('/generate_presentation', methods=['POST'])
+def generate_presentation():
+    data = request.json
+    user_request = data.get('request', '')
+    session_id = data.get('session_id') or str(uuid.uuid4())
+    
+    if not user_request:
+        return jsonify({'error': 'No request provided'}), 400
     
-    sessions[session_id]['iterations'] += 1
+    session = get_session(session_id)
+    # Retrieval is scoped to the request's tenant, else the session's
+    tenant = data.get('tenant') or session.get('tenant') or DEFAULT_TENANT
+    if not valid_tenant(tenant):
+        return jsonify({'error': 'Invalid tenant'}), 400
+    session['tenant'] = tenant
+    # "fresh" skips the response cache for users who want a new variant
+    fresh = bool(data.get('fresh'))
+    # "parallel" outlines the deck first and writes slides concurrently
+    mode = data.get('mode', 'single')
     
-    return jsonify({
+    if data.get('stream'):
+        stream = stream_presentation_parallel if mode == 'parallel' else stream_presentation
+        return Response(
+            stream_with_context(stream(user_request, session_id, session, fresh)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    if data.get('async'):
+        try:
+            job = submit_job('generate', run_generation_job, user_request, session_id, session, fresh, mode)
+        except JobQueueFull as e:
+            return jsonify({'error': f'Server busy: {str(e)}'}), 503
+        return job_accepted(job)
+    
+    return jsonify(generate_structure(user_request, session_id, session, fresh=fresh, mode=mode))
+
+def generate_structure(user_request, session_id, session, progress=None, fresh=False, mode='single'):
+    """Retrieve context, query the model and parse the deck structure"""
+    if mode == 'parallel':
+        return generate_structure_parallel(user_request, session_id, session, progress, fresh)
+    
+    prompt = build_generation_prompt(user_request, session)
+    if progress:
+        progress(0.1, 'Querying model')
+    
+    response = query_ollama(prompt, use_cache=not fresh)
+    
+    if progress:
+        progress(0.8, 'Checking slides')
+    presentation_structure = finish_structure(response, prompt, fresh)
+    
+    iteration = finish_iteration(session_id, session)
+    
+    return {
+        'session_id': session_id,
+        'structure': presentation_structure,
+        'iteration': iteration
+    }
+
+def generate_structure_parallel(user_request, session_id, session, progress=None, fresh=False):
+    outline = None
+    slides = {}
+    for event in iter_parallel_generation(user_request, session, fresh):
+        if event[0] == 'outline':
+            outline = event[1]
+        else:
+            slides[event[1]] = event[2]
+        if progress:
+            total = len(outline['slides']) or 1
+            progress(0.1 + 0.9 * len(slides) / total, f'{len(slides)} of {total} slides written')
+    
+    iteration = finish_iteration(session_id, session)
+    
+    return {
+        'session_id': session_id,
+        'structure': assemble_structure(outline, slides),
+        'iteration': iteration
+    }
+
+def build_generation_prompt(user_request, session):
+    context = retrieve_context(user_request, tenant=session['tenant'])
+    return build_presentation_prompt(user_request, context, build_previous_context(session))
+
+def finish_structure(response, prompt, fresh=False):
+    """Parse the model's deck and repair its invalid slides; unusable output is uncached"""
+    presentation_structure = parse_presentation_response(response)
+    if not isinstance(presentation_structure, dict):
+        get_response_cache().discard(response_cache_key(prompt))
+        return dict(FALLBACK_STRUCTURE)
+    return repair_structure(presentation_structure, fresh)
+
+def run_generation_job(job, user_request, session_id, session, fresh=False, mode='single'):
+    def progress(fraction, message):
+        update_job(job, progress=fraction, message=message)
+    return generate_structure(user_request, session_id, session, progress, fresh, mode)
+
+def stream_presentation(user_request, session_id, session, fresh=False):
+    """SSE generator: push each slide to the browser as soon as it is complete"""
+    yield sse_event('session', {'session_id': session_id})
+    
+    prompt = build_generation_prompt(user_request, session)
+    
+    parser = SlideStreamParser()
+    meta_sent = False
+    
+    try:
+        for fragment in stream_ollama(prompt, use_cache=not fresh):
+            for slide in parser.feed(fragment):
+                if not meta_sent:
+                    yield sse_event('meta', parser.header())
+                    meta_sent = True
+                yield sse_event('slide', {'index': len(parser.slides) - 1, 'slide': slide})
+    except Exception as e:
+        yield sse_event('error', {'error': f"Error querying Ollama: {str(e)}"})
+        if not parser.slides:
+            return
+    
+    presentation_structure = finish_structure(parser.buffer, prompt, fresh)
+    
+    iteration = finish_iteration(session_id, session)
+    
+    yield sse_event('done', {
         'session_id': session_id,
         'structure': presentation_structure,
-        'iteration': sessions[session_id]['iterations']
+        'iteration': iteration
+    })
+
+def stream_presentation_parallel(user_request, session_id, session, fresh=False):
+    """SSE generator for parallel mode: slides arrive in completion order"""
+    yield sse_event('session', {'session_id': session_id})
+    
+    outline = None
+    slides = {}
+    try:
+        for event in iter_parallel_generation(user_request, session, fresh):
+            if event[0] == 'outline':
+                outline = event[1]
+                yield sse_event('meta', {
+                    'title': outline.get('title', ''),
+                    'subtitle': outline.get('subtitle', ''),
+                    'color_scheme': outline.get('color_scheme', 'corporate_blue'),
+                    'slide_count': len(outline['slides'])
+                })
+            else:
+                slides[event[1]] = event[2]
+                yield sse_event('slide', {'index': event[1], 'slide': event[2]})
+    except Exception as e:
+        yield sse_event('error', {'error': f"Error querying Ollama: {str(e)}"})
+        if not slides:
+            return
+    
+    iteration = finish_iteration(session_id, session)
+    
+    yield sse_event('done', {
+        'session_id': session_id,
+        'structure': assemble_structure(outline, slides),
+        'iteration': iteration
     })
 
 @app.route('/confirm_presentation', methods=['POST'])
@@ -651,15 +3568,29 @@ def confirm_presentation():
     structure = data.get('structure')
     feedback = data.get('feedback', '')
     
-    if not session_id or session_id not in sessions:
+    session = get_session_store().get(session_id) if session_id else None
+    if session is None:
         return jsonify({'error': 'Invalid session'}), 400
+    if not isinstance(structure, dict) and (confirmed or structure is not None):
+        return jsonify({'error': 'structure must be a JSON object'}), 400
+    
+    # "download" renders in memory and returns the file in this response
+    if confirmed and data.get('download'):
+        try:
+            return pptx_response(render_to_bytes(structure), structure.get('title'))
+        except Exception as e:
+            return jsonify({'error': f'Error generating presentation: {str(e)}'}), 500
+    
+    if confirmed and data.get('async'):
+        try:
+            job = submit_job('render', run_render_job, structure)
+        except JobQueueFull as e:
+            return jsonify({'error': f'Server busy: {str(e)}'}), 503
+        return job_accepted(job)
     
     if confirmed:
         try:
-            prs = create_presentation(structure)
-            output_filename = f"presentation_{session_id}.pptx"
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-            prs.save(output_path)
+            output_filename = save_presentation(structure)
             
             return jsonify({
                 'success': True,
@@ -669,22 +3600,299 @@ def confirm_presentation():
         except Exception as e:
             return jsonify({'error': f'Error generating presentation: {str(e)}'}), 500
     else:
-        sessions[session_id]['history'].append({
-            'structure': structure,
-            'feedback': feedback
-        })
+        record_feedback(session, structure, feedback)
+        get_session_store().save(session_id, session)
         
         return jsonify({
             'success': True,
             'message': 'Feedback recorded. Please submit a new generation request.'
         })
 
+PPTX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+def structure_hash(structure):
+    material = json.dumps([structure, app.config['RENDER_MODE']], sort_keys=True, ensure_ascii=False)
+    return sha256_text(material)
+
+def render_to_bytes(structure):
+    """Render a deck straight into memory"""
+    prs = create_presentation(structure)
+    buffer = BytesIO()
+    with span('save'):
+        prs.save(buffer)
+    return buffer.getvalue()
+
+def pptx_response(data, title=None):
+    filename = secure_filename(str(title or '')) or 'presentation'
+    return Response(data, mimetype=PPTX_MIMETYPE, headers={
+        'Content-Disposition': f'attachment; filename="{filename}.pptx"'
+    })
+
+def save_presentation(structure):
+    """Render a deck into the output folder and return its filename.
+
+    An identical deck that is already on disk is reused instead of rendered.
+    """
+    output_filename = f"presentation_{structure_hash(structure)[:32]}.pptx"
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    try:
+        os.utime(output_path)
+        metrics.inc('rag_output_dedup_hits_total')
+        return output_filename
+    except FileNotFoundError:
+        # Never rendered, or pruned by another request since; render it now
+        pass
+    
+    prs = create_presentation(structure)
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    with span('save'):
+        prs.save(temp_path)
+    os.replace(temp_path, output_path)
+    prune_outputs(keep={output_path})
+    return output_filename
+
+def prune_outputs(keep=()):
+    """Delete expired outputs, then the least recently used until under
+    OUTPUT_MAX_BYTES; paths in keep are never deleted"""
+    now = time.time()
+    files = []
+    total = 0
+    removed = 0
+    for entry in os.scandir(app.config['OUTPUT_FOLDER']):
+        try:
+            if not entry.is_file() or entry.path in keep:
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > app.config['OUTPUT_MAX_AGE_SECONDS']:
+                os.remove(entry.path)
+                removed += 1
+                continue
+        except OSError:
+            continue
+        total += stat.st_size
+        # Never evict a file still being written
+        if not entry.name.endswith('.tmp'):
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    for _, size, path in sorted(files):
+        if total <= app.config['OUTPUT_MAX_BYTES']:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        metrics.inc('rag_outputs_evicted_total', removed)
+
+def run_render_job(job, structure):
+    update_job(job, progress=0.1, message='Rendering slides')
+    output_filename = save_presentation(structure)
+    download_url = f'/download/{output_filename}'
+    update_job(job, result_url=download_url)
+    return {
+        'success': True,
+        'message': 'Presentation generated successfully',
+        'download_url': download_url
+    }
+
+def render_deck(structure, output_path):
+    """Render and save one deck; runs in the render pool's worker processes"""
+    started = time.perf_counter()
+    prs = create_presentation(structure)
+    rendered = time.perf_counter()
+    # Written under a .tmp name so prune_outputs leaves it alone until complete
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        prs.save(temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {
+        'slides': len(prs.slides),
+        'render_seconds': round(rendered - started, 4),
+        'save_seconds': round(time.perf_counter() - rendered, 4),
+        'bytes': os.path.getsize(output_path)
+    }
+
+def get_render_pool():
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=app.config['RENDER_WORKERS'])
+    return render_pool
+
+def batch_record(record, number):
+    """Accept {"name": ..., "structure": {...}} or a bare structure"""
+    if isinstance(record, dict) and 'structure' in record:
+        return {'name': str(record.get('name') or f'deck_{number}'), 'structure': record['structure']}
+    return {'name': f'deck_{number}', 'structure': record}
+
+def load_batch_lines(lines):
+    """Parse JSONL decks; a malformed line becomes a failed entry, not an abort"""
+    decks = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            decks.append(batch_record(json.loads(line), number))
+        except ValueError as e:
+            decks.append({'name': f'deck_{number}', 'error': f'Invalid JSON on line {number}: {str(e)}'})
+    return decks
+
+def load_batch(path):
+    """Read decks from a directory of .json files or from a .jsonl file"""
+    if not os.path.isdir(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return load_batch_lines(file)
+    decks = []
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.json'):
+            continue
+        name = os.path.splitext(filename)[0]
+        try:
+            with open(os.path.join(path, filename), 'r', encoding='utf-8') as file:
+                decks.append({'name': name, 'structure': json.load(file)})
+        except ValueError as e:
+            decks.append({'name': name, 'error': f'Invalid JSON: {str(e)}'})
+    return decks
+
+def render_batch(decks, output_dir, zip_path=None, prefix='', progress=None):
+    """Render decks in the process pool and report per-deck timing and failures.
+
+    With zip_path each finished deck is moved from output_dir into a single
+    archive, written under a .tmp name until it is complete.
+    progress(entry, done, total) is called as decks complete.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pool = get_render_pool()
+    started = time.perf_counter()
+    report = []
+    futures = {}
+    names = set()
+    
+    for deck in decks:
+        base = name = secure_filename(deck['name']) or 'deck'
+        suffix = 1
+        while name in names:
+            suffix += 1
+            name = f"{base}_{suffix}"
+        names.add(name)
+        entry = {'name': name, 'file': f'{prefix}{name}.pptx', 'ok': False}
+        report.append(entry)
+        if deck.get('error'):
+            entry['error'] = deck['error']
+        elif not isinstance(deck.get('structure'), dict):
+            entry['error'] = 'Structure must be a JSON object'
+        else:
+            futures[pool.submit(render_deck, deck['structure'], os.path.join(output_dir, entry['file']))] = entry
+    
+    temp_zip_path = f"{zip_path}.{uuid.uuid4().hex}.tmp" if zip_path else None
+    archive = zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_STORED) if zip_path else None
+    completed = False
+    try:
+        done = 0
+        for entry in report:
+            if 'error' in entry:
+                done += 1
+                if progress:
+                    progress(entry, done, len(report))
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                entry.update(future.result(), ok=True)
+            except Exception as e:
+                entry['error'] = str(e)
+            else:
+                if archive:
+                    path = os.path.join(output_dir, entry['file'])
+                    archive.write(path, f"{entry['name']}.pptx")
+                    os.remove(path)
+            done += 1
+            if progress:
+                progress(entry, done, len(report))
+        completed = True
+    finally:
+        if archive:
+            archive.close()
+            if completed:
+                os.replace(temp_zip_path, zip_path)
+            else:
+                os.remove(temp_zip_path)
+    
+    rendered = sum(1 for entry in report if entry['ok'])
+    return {
+        'decks': report,
+        'rendered': rendered,
+        'failed': len(report) - rendered,
+        'seconds': round(time.perf_counter() - started, 3),
+        'workers': app.config['RENDER_WORKERS'],
+        'zip': zip_path
+    }
+
+@app.route('/batch_render', methods=['POST'])
+def batch_render():
+    """Render many structures (JSON "decks" list or a JSONL "file") as one job"""
+    if 'file' in request.files:
+        decks = load_batch_lines(request.files['file'].stream)
+        as_zip = request.form.get('zip', '1') != '0'
+    else:
+        data = request.get_json(silent=True) or {}
+        records = data.get('decks')
+        if not isinstance(records, list):
+            return jsonify({'error': 'Provide "decks" as a list or upload a JSONL "file"'}), 400
+        decks = [batch_record(record, number) for number, record in enumerate(records, 1)]
+        as_zip = bool(data.get('zip', True))
+    
+    if not decks:
+        return jsonify({'error': 'No decks provided'}), 400
+    if len(decks) > app.config['BATCH_MAX_DECKS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_DECKS']} decks per batch"}), 400
+    
+    try:
+        job = submit_job('batch', run_batch_job, decks, as_zip)
+    except JobQueueFull as e:
+        return jsonify({'error': f'Server busy: {str(e)}'}), 503
+    return job_accepted(job)
+
+def run_batch_job(job, decks, as_zip):
+    def progress(entry, done, total):
+        update_job(job, progress=done / total, message=f'{done} of {total} decks rendered')
+    
+    output_folder = app.config['OUTPUT_FOLDER']
+    if as_zip:
+        zip_name = f"batch_{job['id']}.zip"
+        work_dir = tempfile.mkdtemp(dir=output_folder)
+        try:
+            report = render_batch(decks, work_dir, os.path.join(output_folder, zip_name), progress=progress)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        report['zip'] = zip_name
+        report['download_url'] = f'/download/{zip_name}'
+        update_job(job, result_url=report['download_url'])
+        outputs = {os.path.join(output_folder, zip_name)}
+    else:
+        report = render_batch(decks, output_folder, prefix=f"batch_{job['id'][:8]}_", progress=progress)
+        for entry in report['decks']:
+            if entry['ok']:
+                entry['download_url'] = f"/download/{entry['file']}"
+        outputs = {os.path.join(output_folder, entry['file']) for entry in report['decks'] if entry['ok']}
+    prune_outputs(keep=outputs)
+    return report
+
 @app.route('/download/<filename>')
 def download_file(filename):
     file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
+    if os.path.isfile(file_path):
+        return send_from_directory(os.path.abspath(app.config['OUTPUT_FOLDER']), filename, as_attachment=True)
     return jsonify({'error': 'File not found'}), 404
 
+if app.config['WARM_INDEX'] and multiprocessing.parent_process() is None:
+    warm_index()
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     app.run(debug=True, port=5000)
@@ -0,0 +1,420 @@
+"""Asynchronous (ASGI) serving mode.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --port 5000
+
+POST /generate_presentation (plain or streamed, single mode) runs on the event
+loop: Ollama is called through an aiohttp session, so a request waiting for the
+model costs a coroutine rather than a thread, while retrieval, parsing and
+session writes are offloaded to a pool of ASGI_THREADS threads. Every other
+route, and parallel-mode or background-job generations, are served by the
+Flask app through a WSGI bridge running on a second pool of that size.
+"""
+import asyncio
+import contextvars
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiohttp
+from a2wsgi import WSGIMiddleware
+
+import app
+
+
+class AsyncOllamaClient(app.OllamaClient):
+    """OllamaClient on an aiohttp session with an asyncio slot limit.
+
+    Once bound to the serving loop, the blocking generate() and
+    generate_stream() used by the Flask routes are run on that loop as well,
+    so OLLAMA_MAX_CONCURRENCY caps coroutines and threads together.
+    """
+
+    def __init__(self, url, max_concurrency=2, queue_timeout=120, connect_timeout=5,
+                 read_timeout=300, retries=2, backoff=0.5):
+        super().__init__(url, max_concurrency, queue_timeout, connect_timeout, read_timeout, retries, backoff)
+        self.max_connections = max(max_concurrency, 1)
+        self.async_slots = asyncio.Semaphore(max_concurrency)
+        self.http = None
+        self.loop = None
+
+    def bind(self, loop):
+        """Attach to the serving loop; the aiohttp session must be created on it"""
+        self.loop = loop
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+            read_bufsize=2 ** 20
+        )
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+
+    def bridged(self):
+        """Whether a blocking caller should hand its generation to the serving loop"""
+        if self.loop is None or not self.loop.is_running():
+            return False
+        try:
+            return asyncio.get_running_loop() is not self.loop
+        except RuntimeError:
+            return True
+
+    @asynccontextmanager
+    async def async_slot(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.async_slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.record(rejected=1)
+            raise app.OllamaBusy(f'No Ollama slot free after {self.queue_timeout:.0f}s')
+        waited = time.perf_counter() - started
+        self.record(queue_wait_seconds=waited, queue_wait_max_seconds=waited, in_flight=1)
+        try:
+            yield
+        finally:
+            self.record(in_flight=-1)
+            self.async_slots.release()
+
+    async def async_post(self, payload):
+        """POST to Ollama with OllamaClient's retries; the body is read by the caller"""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.http.post(self.url, json=payload)
+                if response.status in self.RETRY_STATUSES and attempt < self.retries:
+                    response.release()
+                else:
+                    if not response.ok:
+                        response.release()
+                    response.raise_for_status()
+                    return response
+            except (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError):
+                if attempt == self.retries:
+                    raise
+            self.record(retries=1)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def async_generate(self, payload):
+        async with self.async_slot():
+            started = time.perf_counter()
+            self.record(requests=1)
+            try:
+                async with await self.async_post(payload) as response:
+                    return await response.json(content_type=None)
+            except Exception:
+                self.record(errors=1)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(generation_seconds=elapsed, generation_max_seconds=elapsed)
+
+    async def async_generate_stream(self, payload):
+        async with self.async_slot():
+            started = time.perf_counter()
+            self.record(requests=1)
+            try:
+                async with await self.async_post(payload) as response:
+                    async for line in response.content:
+                        if line.strip():
+                            yield json.loads(line)
+            except Exception:
+                self.record(errors=1)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(generation_seconds=elapsed, generation_max_seconds=elapsed)
+
+    def generate(self, payload):
+        if not self.bridged():
+            return super().generate(payload)
+        return asyncio.run_coroutine_threadsafe(self.async_generate(payload), self.loop).result()
+
+    def generate_stream(self, payload):
+        if not self.bridged():
+            yield from super().generate_stream(payload)
+            return
+        stream = self.async_generate_stream(payload)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(stream.__anext__(), self.loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), self.loop).result()
+
+
+def get_ollama_client():
+    """Install the async client as the app's shared Ollama client"""
+    if not isinstance(app.ollama_client, AsyncOllamaClient):
+        app.ollama_client = AsyncOllamaClient(
+            app.OLLAMA_URL,
+            max_concurrency=app.app.config['OLLAMA_MAX_CONCURRENCY'],
+            queue_timeout=app.app.config['OLLAMA_QUEUE_TIMEOUT'],
+            connect_timeout=app.app.config['OLLAMA_CONNECT_TIMEOUT'],
+            read_timeout=app.app.config['OLLAMA_READ_TIMEOUT'],
+            retries=app.app.config['OLLAMA_RETRIES'],
+            backoff=app.app.config['OLLAMA_BACKOFF_SECONDS']
+        )
+    return app.ollama_client
+
+
+executor = ThreadPoolExecutor(max_workers=app.app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+
+def offload(func, *args):
+    """Run blocking work on the executor, keeping the request's trace"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+
+async def query_ollama(prompt, context="", use_cache=True):
+    """Async twin of app.query_ollama"""
+    key = app.response_cache_key(prompt, context)
+    cache = app.get_response_cache()
+    if use_cache:
+        cached = await offload(cache.get, key)
+        if cached is not None:
+            return cached
+
+    try:
+        with app.span('llm', stream=False) as attributes:
+            body = await get_ollama_client().async_generate(app.ollama_payload(prompt, context))
+            attributes.update(app.record_llm_usage(body))
+        response = body['response']
+    except Exception as e:
+        return f"Error querying Ollama: {str(e)}"
+
+    await offload(cache.put, key, response)
+    return response
+
+async def stream_ollama(prompt, context="", use_cache=True):
+    """Async twin of app.stream_ollama"""
+    key = app.response_cache_key(prompt, context)
+    cache = app.get_response_cache()
+    if use_cache:
+        cached = await offload(cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+
+    fragments = []
+    started = time.perf_counter()
+    first_token = None
+    async for chunk in get_ollama_client().async_generate_stream(app.ollama_payload(prompt, context, stream=True)):
+        if chunk.get('error'):
+            raise RuntimeError(chunk['error'])
+        if chunk.get('response'):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            fragments.append(chunk['response'])
+            yield chunk['response']
+        if chunk.get('done'):
+            usage = app.record_llm_usage(chunk)
+            if first_token is not None:
+                usage['first_token_ms'] = round(first_token * 1000, 2)
+            app.record_span('llm', time.perf_counter() - started, stream=True, **usage)
+            await offload(cache.put, key, "".join(fragments))
+            break
+
+
+async def generate_structure(user_request, session_id, session, fresh=False):
+    prompt = await offload(app.build_generation_prompt, user_request, session)
+    response = await query_ollama(prompt, use_cache=not fresh)
+    presentation_structure = await offload(app.finish_structure, response, prompt, fresh)
+    iteration = await offload(app.finish_iteration, session_id, session)
+    return {
+        'session_id': session_id,
+        'structure': presentation_structure,
+        'iteration': iteration
+    }
+
+async def stream_presentation(user_request, session_id, session, fresh=False):
+    """Async twin of app.stream_presentation"""
+    yield app.sse_event('session', {'session_id': session_id})
+
+    prompt = await offload(app.build_generation_prompt, user_request, session)
+
+    parser = app.SlideStreamParser()
+    meta_sent = False
+
+    try:
+        async for fragment in stream_ollama(prompt, use_cache=not fresh):
+            for slide in parser.feed(fragment):
+                if not meta_sent:
+                    yield app.sse_event('meta', parser.header())
+                    meta_sent = True
+                yield app.sse_event('slide', {'index': len(parser.slides) - 1, 'slide': slide})
+    except Exception as e:
+        yield app.sse_event('error', {'error': f"Error querying Ollama: {str(e)}"})
+        if not parser.slides:
+            return
+
+    presentation_structure = await offload(app.finish_structure, parser.buffer, prompt, fresh)
+    iteration = await offload(app.finish_iteration, session_id, session)
+
+    yield app.sse_event('done', {
+        'session_id': session_id,
+        'structure': presentation_structure,
+        'iteration': iteration
+    })
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+async def send_json(send, status, body, headers):
+    data = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers + [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': data})
+    return status
+
+async def send_events(send, receive, events, headers):
+    """Send an SSE stream, abandoning generation if the client disconnects"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': headers + [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]
+    })
+    streaming = asyncio.current_task()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        streaming.cancel()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        async for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    except asyncio.CancelledError:
+        if not watcher.done():
+            raise
+        streaming.uncancel()
+    finally:
+        watcher.cancel()
+        await events.aclose()
+    return 200
+
+async def generate_presentation(scope, receive, send, data):
+    """Async twin of the /generate_presentation route, traced like Flask requests"""
+    trace = app.new_trace(method='POST', path=scope['path'])
+    request_id = header(scope, b'x-request-id')
+    if app.REQUEST_ID_RE.fullmatch(request_id):
+        trace['trace_id'] = request_id
+    app.current_trace.set(trace)
+    started = time.perf_counter()
+    headers = [(b'x-request-id', trace['trace_id'].encode())]
+    status = 500
+    try:
+        user_request = data.get('request', '')
+        session_id = data.get('session_id') or str(uuid.uuid4())
+
+        if not user_request:
+            status = await send_json(send, 400, {'error': 'No request provided'}, headers)
+            return
+
+        session = await offload(app.get_session, session_id)
+        tenant = data.get('tenant') or session.get('tenant') or app.DEFAULT_TENANT
+        if not app.valid_tenant(tenant):
+            status = await send_json(send, 400, {'error': 'Invalid tenant'}, headers)
+            return
+        session['tenant'] = tenant
+        fresh = bool(data.get('fresh'))
+
+        if data.get('stream'):
+            events = stream_presentation(user_request, session_id, session, fresh)
+            status = await send_events(send, receive, events, headers)
+        else:
+            result = await generate_structure(user_request, session_id, session, fresh)
+            status = await send_json(send, 200, result, headers)
+    finally:
+        elapsed = time.perf_counter() - started
+        labels = {'endpoint': 'generate_presentation', 'method': 'POST'}
+        app.metrics.observe('rag_http_request_duration_seconds', elapsed, **labels)
+        app.metrics.inc('rag_http_requests_total', status=status, **labels)
+        app.log_trace(trace, status=status, duration_ms=round(elapsed * 1000, 2))
+
+
+flask_app = WSGIMiddleware(app.app, workers=app.app.config['ASGI_THREADS'])
+
+async def read_body(scope, receive):
+    """The request body, or None once it exceeds MAX_CONTENT_LENGTH"""
+    limit = app.app.config['MAX_CONTENT_LENGTH']
+    headers = dict(scope['headers'])
+    if limit is not None and int(headers.get(b'content-length') or 0) > limit:
+        return None
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def replay(body, receive):
+    """A receive callable that hands an already-read body to the WSGI bridge"""
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def replayed():
+        if pending:
+            return pending.pop()
+        return await receive()
+    return replayed
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_ollama_client().bind(asyncio.get_running_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await get_ollama_client().close()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    client = get_ollama_client()
+    if client.loop is None:
+        client.bind(asyncio.get_running_loop())
+
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/generate_presentation':
+        body = await read_body(scope, receive)
+        if body is None:
+            await send_json(send, 413, {'error': 'Request body too large'}, [])
+            return
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        # Parallel mode and background jobs keep their thread-based paths
+        if isinstance(data, dict) and not data.get('async') and data.get('mode', 'single') != 'parallel':
+            await generate_presentation(scope, receive, send, data)
+            return
+        receive = replay(body, receive)
+
+    await flask_app(scope, receive, send)
+
+
+get_ollama_client()
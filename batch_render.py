@@ -0,0 +1,66 @@
+"""Render many decks from JSON structures without going through the web server.
+
+    python batch_render.py decks/ --output rendered/
+    python batch_render.py decks.jsonl --zip decks.zip --workers 8 --report report.json
+
+The source is a directory of .json structures or a JSONL file with one
+structure (or {"name": ..., "structure": {...}}) per line. Exits with status 1
+if any deck failed.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# The CLI never queries the document index, so don't load it at import
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app
+
+
+def print_progress(entry, done, total):
+    if entry['ok']:
+        detail = f"{entry['slides']} slides, {entry['render_seconds'] + entry['save_seconds']:.2f}s"
+        print(f"[{done}/{total}] ok    {entry['name']} ({detail})")
+    else:
+        print(f"[{done}/{total}] FAIL  {entry['name']}: {entry['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='directory of .json files or a .jsonl file')
+    parser.add_argument('--output', default='batch_output', help='directory for the rendered decks')
+    parser.add_argument('--zip', help='write every deck into this zip file instead of --output')
+    parser.add_argument('--workers', type=int, help='render processes (default: RENDER_WORKERS, all cores)')
+    parser.add_argument('--report', help='write the per-deck report as JSON to this path')
+    args = parser.parse_args()
+
+    if args.workers:
+        app.app.config['RENDER_WORKERS'] = args.workers
+
+    decks = app.load_batch(args.source)
+    if not decks:
+        print(f'No decks found in {args.source}', file=sys.stderr)
+        return 1
+
+    if args.zip:
+        output_dir = tempfile.mkdtemp()
+        try:
+            report = app.render_batch(decks, output_dir, zip_path=args.zip, progress=print_progress)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    else:
+        report = app.render_batch(decks, args.output, progress=print_progress)
+
+    print(f"Rendered {report['rendered']} of {len(decks)} decks in {report['seconds']:.1f}s "
+          f"with {report['workers']} workers -> {args.zip or args.output}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""Shared embedding service: loads the model once for every app worker.
+
+    python embedding_service.py --port 8765
+    EMBEDDING_SERVICE_URL=http://127.0.0.1:8765 gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+Concurrent requests are merged into micro-batches (up to --max-batch texts,
+waiting at most --max-wait-ms for more to arrive) and embeddings of repeated
+texts are served from an in-memory LRU cache.
+"""
+import argparse
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_embedding_function(model='default'):
+    """Chroma's default model (what the index uses without the service) or a sentence-transformers model"""
+    from chromadb.utils import embedding_functions
+    if model == 'default':
+        return embedding_functions.DefaultEmbeddingFunction()
+    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model)
+
+
+class MicroBatcher:
+    """Collect texts from concurrent callers and embed them in shared batches"""
+
+    def __init__(self, embed, max_batch=64, max_wait=0.005, cache_size=10000):
+        self.embed_batch = embed
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'texts': 0,
+            'cache_hits': 0,
+            'batches': 0,
+            'batched_texts': 0,
+            'embed_seconds': 0.0
+        }
+        threading.Thread(target=self.run, name='embed-batcher', daemon=True).start()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def embed(self, texts):
+        """Embed texts, blocking until the batch containing them has run"""
+        keys = [self.key(text) for text in texts]
+        vectors = {}
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['texts'] += len(texts)
+            for key in keys:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    vectors[key] = self.cache[key]
+            self.counters['cache_hits'] += sum(1 for key in keys if key in vectors)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            future = Future()
+            self.pending.put((missing, future))
+            vectors.update(future.result())
+        return [vectors[key] for key in keys]
+
+    def run(self):
+        while True:
+            batch = [self.pending.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self.process(batch)
+
+    def process(self, batch):
+        texts = {}
+        for missing, _ in batch:
+            texts.update(missing)
+        keys = list(texts)
+        try:
+            started = time.perf_counter()
+            embeddings = self.embed_batch([texts[key] for key in keys])
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        vectors = {key: [float(value) for value in vector] for key, vector in zip(keys, embeddings)}
+        with self.lock:
+            self.counters['batches'] += 1
+            self.counters['batched_texts'] += len(keys)
+            self.counters['embed_seconds'] += elapsed
+            for key, vector in vectors.items():
+                self.cache[key] = vector
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        for missing, future in batch:
+            future.set_result({key: vectors[key] for key in missing})
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['cache_entries'] = len(self.cache)
+        stats['mean_batch_size'] = stats['batched_texts'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+def make_handler(batcher):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send_json(200, batcher.stats())
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/embed':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                texts = json.loads(self.rfile.read(length) or b'{}').get('texts')
+            except (ValueError, AttributeError):
+                texts = None
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                self.send_json(400, {'error': 'Expected {"texts": [str, ...]}'})
+                return
+            try:
+                self.send_json(200, {'embeddings': batcher.embed(texts)})
+            except Exception as e:
+                self.send_json(500, {'error': f'Embedding failed: {str(e)}'})
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return EmbeddingHandler
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_embedding_service(embed, host='127.0.0.1', port=0, **batching):
+    """Serve on a background thread; returns the server (see server.url and server.batcher)"""
+    batcher = MicroBatcher(embed, **batching)
+    server = EmbeddingServer((host, port), make_handler(batcher))
+    server.batcher = batcher
+    server.url = f'http://{host}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, name='embedding-service', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model', default='default', help='"default" or a sentence-transformers model name')
+    parser.add_argument('--max-batch', type=int, default=64, help='texts per model call')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='how long a batch waits to fill')
+    parser.add_argument('--cache-size', type=int, default=10000, help='embeddings kept for repeated texts')
+    args = parser.parse_args()
+
+    batcher = MicroBatcher(
+        load_embedding_function(args.model),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000,
+        cache_size=args.cache_size
+    )
+    server = EmbeddingServer((args.host, args.port), make_handler(batcher))
+    print(f'Embedding service listening on http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""CSV chart data parsed by normalize_chart."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app  # noqa: E402
+
+
+def test_non_numeric_csv_cells_become_gaps():
+    chart = app.normalize_chart({'type': 'line', 'csv': 'Quarter,Sales\nQ1,"1,200"\nQ2,n/a\nQ3,—\nQ4,\nQ5,nan\n'})
+
+    assert chart['categories'] == ['Q1', 'Q2', 'Q3', 'Q4', 'Q5']
+    assert chart['series'] == [{'name': 'Sales', 'values': [1200.0, None, None, None, None]}]
+
+
+def test_chart_with_gaps_renders():
+    structure = {'title': 'Deck', 'slides': [{
+        'type': 'chart', 'title': 'Sales',
+        'chart_data': {'type': 'column', 'csv': 'Quarter,Sales\nQ1,10\nQ2,n/a\nQ3,30\n'}
+    }]}
+
+    assert app.render_to_bytes(structure)[:2] == b'PK'
@@ -0,0 +1,47 @@
+"""Overlap between adjacent chunks produced by iter_chunks."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app  # noqa: E402
+
+
+def words(chunk):
+    return chunk['text'].split()
+
+
+def test_unpunctuated_text_keeps_word_overlap():
+    text = ' '.join(f'w{i}' for i in range(1200))
+
+    chunks = list(app.iter_chunks(text, max_tokens=100, overlap_tokens=20))
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert words(previous)[-20:] == words(current)[:20]
+        assert current['start'] < previous['end']
+        assert current['tokens'] <= 100
+    assert words(chunks[-1])[-1] == 'w1199'
+
+
+def test_sentences_carry_whole_sentences_as_overlap():
+    sentences = [f'Sentence number {i} is here.' for i in range(60)]
+    text = ' '.join(sentences)
+
+    chunks = list(app.iter_chunks(text, max_tokens=60, overlap_tokens=14))
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        first = current['text'].split('. ')[0] + '.'
+        assert first in sentences
+        assert first in previous['text']
+
+
+def test_zero_overlap_shares_nothing():
+    text = ' '.join(f'w{i}' for i in range(500))
+
+    chunks = list(app.iter_chunks(text, max_tokens=100, overlap_tokens=0))
+
+    assert sum(len(words(chunk)) for chunk in chunks) == 500
@@ -0,0 +1,141 @@
+"""Drive OllamaClient and SlideStreamParser against tools/stub_ollama.py.
+
+    python -m pytest -q tests
+"""
+import json
+import os
+import socket
+import sys
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tools')]
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app  # noqa: E402
+from stub_ollama import SAMPLE_DECK, start_stub_server  # noqa: E402
+
+PAYLOAD = {'model': 'stub', 'prompt': 'Make a deck'}
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**behaviour):
+        server = start_stub_server(**behaviour)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_generate_returns_full_response(stub):
+    server = stub()
+    client = app.OllamaClient(server.url)
+
+    body = client.generate(dict(PAYLOAD, stream=False))
+
+    assert json.loads(body['response']) == SAMPLE_DECK
+    stats = client.stats()
+    assert stats['requests'] == 1
+    assert stats['errors'] == 0
+    assert stats['in_flight'] == 0
+
+
+def test_generate_stream_yields_every_token(stub):
+    server = stub()
+    client = app.OllamaClient(server.url)
+
+    messages = list(client.generate_stream(dict(PAYLOAD, stream=True)))
+
+    assert messages[-1]['done'] is True
+    text = ''.join(message['response'] for message in messages)
+    assert json.loads(text) == SAMPLE_DECK
+    assert client.stats()['in_flight'] == 0
+
+
+def test_busy_slot_rejects_after_queue_timeout(stub):
+    server = stub(tokens_per_second=20)
+    client = app.OllamaClient(server.url, max_concurrency=1, queue_timeout=0.1)
+
+    stream = client.generate_stream(dict(PAYLOAD, stream=True))
+    next(stream)
+    try:
+        with pytest.raises(app.OllamaBusy):
+            client.generate(dict(PAYLOAD, stream=False))
+    finally:
+        stream.close()
+
+    stats = client.stats()
+    assert stats['rejected'] == 1
+    assert stats['in_flight'] == 0
+
+
+def test_retries_transient_status_then_fails(stub):
+    server = stub(failure_rate=1.0)
+    client = app.OllamaClient(server.url, retries=2, backoff=0.01)
+
+    with pytest.raises(requests.HTTPError):
+        client.generate(dict(PAYLOAD, stream=False))
+
+    assert server.request_count == 3
+    stats = client.stats()
+    assert stats['retries'] == 2
+    assert stats['errors'] == 1
+
+
+def test_retries_connection_errors_then_fails():
+    url = f'http://127.0.0.1:{free_port()}/api/generate'
+    client = app.OllamaClient(url, retries=1, backoff=0.01, connect_timeout=1)
+
+    with pytest.raises(requests.ConnectionError):
+        list(client.generate_stream(dict(PAYLOAD, stream=True)))
+
+    stats = client.stats()
+    assert stats['retries'] == 1
+    assert stats['errors'] == 1
+    assert stats['in_flight'] == 0
+
+
+def test_slide_parser_recovers_slides_from_stream(stub):
+    server = stub()
+    client = app.OllamaClient(server.url)
+    parser = app.SlideStreamParser()
+
+    emitted = []
+    for message in client.generate_stream(dict(PAYLOAD, stream=True)):
+        emitted.extend(parser.feed(message['response']))
+
+    assert emitted == SAMPLE_DECK['slides']
+    assert parser.structure() == SAMPLE_DECK
+
+
+def test_slide_parser_ignores_brackets_inside_strings():
+    deck = {
+        'title': 'Braces {and} "quotes"',
+        'slides': [
+            {'type': 'bullet', 'title': 'a } b', 'points': ['[x]', 'y \\ z']},
+            {'type': 'bullet', 'title': 'second', 'points': []}
+        ]
+    }
+    text = json.dumps(deck)
+    parser = app.SlideStreamParser()
+
+    emitted = []
+    for i in range(0, len(text), 3):
+        emitted.extend(parser.feed(text[i:i + 3]))
+
+    assert emitted == deck['slides']
+    assert parser.header()['title'] == deck['title']
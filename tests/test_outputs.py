@@ -0,0 +1,26 @@
+"""Reuse of rendered decks in the outputs folder."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app  # noqa: E402
+
+DECK = {'title': 'Deck', 'slides': [{'type': 'bullet', 'title': 'One', 'points': ['a', 'b']}]}
+
+
+def test_deck_pruned_before_reuse_is_rendered_again(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'OUTPUT_FOLDER', str(tmp_path))
+    filename = app.save_presentation(DECK)
+    path = tmp_path / filename
+
+    def pruned(target, *args, **kwargs):
+        os.remove(target)
+        raise FileNotFoundError(target)
+
+    monkeypatch.setattr(app.os, 'utime', pruned)
+
+    assert app.save_presentation(DECK) == filename
+    assert path.stat().st_size > 0
@@ -0,0 +1,64 @@
+"""Refinement feedback recorded through /confirm_presentation."""
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WARM_INDEX', '0')
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def session_id():
+    session_id = str(uuid.uuid4())
+    app.get_session_store().create(session_id)
+    return session_id
+
+
+def confirm(session_id, structure, **fields):
+    client = app.app.test_client()
+    return client.post('/confirm_presentation', json=dict(
+        fields, session_id=session_id, structure=structure, feedback='More charts'))
+
+
+@pytest.mark.parametrize('confirmed', [False, True])
+def test_non_object_structure_is_rejected(session_id, confirmed):
+    response = confirm(session_id, [{'title': 'Deck'}], confirmed=confirmed)
+
+    assert response.status_code == 400
+    assert app.get_session_store().get(session_id)['attempts'] == 0
+
+
+def test_malformed_slides_are_dropped_from_history(session_id):
+    structure = {
+        'title': 'Deck',
+        'slides': ['oops', 3, {'type': 'bullet', 'title': 'Kept', 'points': ['a', 'b']}]
+    }
+
+    response = confirm(session_id, structure, confirmed=False)
+
+    assert response.status_code == 200
+    session = app.get_session_store().get(session_id)
+    assert session['last_structure']['slides'] == [structure['slides'][2]]
+    context = app.build_previous_context(session)
+    assert '1. [bullet] Kept - a; b' in context
+    assert 'first draft with 1 slides' in context
+
+
+def test_summaries_skip_malformed_entries():
+    old = {'title': 'Deck', 'slides': 'oops'}
+    new = {'title': 'Deck', 'slides': [None, {'title': 'Chart', 'type': 'chart', 'chart_data': 'bad'}]}
+
+    assert app.diff_structures(old, new) == "added slide 1 'Chart'"
+    assert app.summarize_structure(new).splitlines()[1] == '1. [chart] Chart - column chart of  over 0 categories'
+    assert app.summarize_structure(None).startswith('Title:')
+
+
+def test_two_column_gist_uses_points():
+    slide = {'type': 'bullet', 'layout': 'two_column', 'title': 'Compare', 'points': ['Left', 'Right', 'More']}
+
+    assert app.slide_gist(slide) == 'Left; Right; More'
@@ -0,0 +1,470 @@
+"""Benchmark suite for the hot paths in app.py.
+
+    python tools/bench.py                               # run everything, print JSON
+    python tools/bench.py --output results.json --save-baseline tools/baseline.json
+    python tools/bench.py --baseline tools/baseline.json --tolerance 0.25
+
+Synthetic PDF/DOCX/TXT corpora and decks mixing every slide type are generated
+in a temporary directory. Each stage reports the median wall time over
+--repeat runs and the peak Python heap allocation of one extra traced run. With
+--baseline the run exits non-zero when any stage is slower, or uses more
+memory, than the baseline by more than --tolerance.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('WARM_INDEX', '0')
+os.environ.setdefault('CHROMA_PATH', '')
+
+import app  # noqa: E402
+import chromadb  # noqa: E402
+import docx  # noqa: E402
+from stub_ollama import start_stub_server  # noqa: E402
+
+SLIDE_KINDS = ('bullet', 'two_column', 'numbered', 'chart', 'table')
+
+WORDS = (
+    'revenue growth market energy solar wind policy customer strategy analysis '
+    'report quarter region product service team risk cost forecast investment '
+    'operations compliance training safety quality supply demand platform data'
+).split()
+
+
+def synthetic_paragraphs(words, seed=0):
+    """Deterministic pseudo-prose: sentences of 8-20 words, paragraphs of 3-6 sentences"""
+    rng = random.Random(seed)
+    paragraphs = []
+    written = 0
+    while written < words:
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            length = rng.randint(8, 20)
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(length))
+            sentences.append(sentence.capitalize() + '.')
+            written += length
+        paragraphs.append(' '.join(sentences))
+    return paragraphs
+
+
+def write_pdf(path, pages):
+    """Write a minimal text-only PDF with one Helvetica text block per page"""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>']
+    kids = ' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))
+    objects.append(f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>')
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>'
+        )
+        lines = [text[j:j + 90] for j in range(0, len(text), 90)]
+        escaped = (line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in lines)
+        stream = 'BT /F1 9 Tf 36 760 Td 11 TL ' + ' '.join(f"({line}) '" for line in escaped) + ' ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out = BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1'))
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('ascii'))
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode('ascii'))
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('ascii'))
+    with open(path, 'wb') as file:
+        file.write(out.getvalue())
+
+
+def build_corpus(directory, words):
+    """Write one PDF, DOCX and TXT file of roughly `words` words each"""
+    paragraphs = synthetic_paragraphs(words)
+    paths = {}
+
+    pages = []
+    page = []
+    for paragraph in paragraphs:
+        page.append(paragraph)
+        if sum(len(p) for p in page) > 3000:
+            pages.append(' '.join(page))
+            page = []
+    if page:
+        pages.append(' '.join(page))
+    paths['pdf'] = os.path.join(directory, 'corpus.pdf')
+    write_pdf(paths['pdf'], pages)
+
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    paths['docx'] = os.path.join(directory, 'corpus.docx')
+    document.save(paths['docx'])
+
+    paths['txt'] = os.path.join(directory, 'corpus.txt')
+    with open(paths['txt'], 'w', encoding='utf-8') as file:
+        file.write('\n\n'.join(paragraphs))
+    return paths
+
+
+def synthetic_deck(slide_count, color_scheme='corporate_blue'):
+    """A deck cycling through every slide type"""
+    slides = []
+    for i in range(slide_count):
+        kind = SLIDE_KINDS[i % len(SLIDE_KINDS)]
+        title = f'Slide {i + 1}: {kind.replace("_", " ").title()}'
+        if kind == 'chart':
+            slides.append({
+                'type': 'chart',
+                'title': title,
+                'chart_data': {
+                    'type': ('column', 'bar', 'line', 'pie')[i % 4],
+                    'categories': ['Q1', 'Q2', 'Q3', 'Q4'],
+                    'series': [{'name': 'Revenue', 'values': [i, i * 2, i * 3, i * 4]}]
+                }
+            })
+        elif kind == 'table':
+            slides.append({
+                'type': 'table',
+                'title': title,
+                'table_data': {
+                    'headers': ['Region', 'Units', 'Revenue', 'Growth'],
+                    'rows': [[f'Region {r}', str(r * 10), f'{r * 1.5:.1f}M', f'{r}%'] for r in range(6)]
+                }
+            })
+        else:
+            slides.append({
+                'type': 'bullet',
+                'layout': kind,
+                'title': title,
+                'points': [f'Point {p} of slide {i + 1} with some supporting detail' for p in range(6)]
+            })
+    return {
+        'title': 'Benchmark Deck',
+        'subtitle': f'{slide_count} synthetic slides',
+        'color_scheme': color_scheme,
+        'slides': slides
+    }
+
+
+def data_heavy_deck(rows=500, points=5000):
+    """A long table (continued over several slides) and charts with long series"""
+    csv_lines = ['Day,Units,Revenue'] + [f'Day {d},{d % 97},{(d * 37) % 1000}' for d in range(points)]
+    return {
+        'title': 'Data Heavy Deck',
+        'color_scheme': 'corporate_blue',
+        'slides': [
+            {
+                'type': 'table',
+                'title': 'Orders',
+                'table_data': {
+                    'headers': ['Order', 'Region', 'Units', 'Revenue'],
+                    'rows': [[f'#{r}', f'Region {r % 12}', str(r % 50), f'{r * 1.5:.1f}'] for r in range(rows)]
+                }
+            },
+            {'type': 'chart', 'title': 'Daily Sales', 'chart_data': {'type': 'line', 'csv': '\n'.join(csv_lines)}},
+            {
+                'type': 'chart',
+                'title': 'Share by Product',
+                'chart_data': {
+                    'type': 'pie',
+                    'categories': [f'Product {p}' for p in range(200)],
+                    'series': [{'name': 'Share', 'values': [(p * 13) % 101 for p in range(200)]}]
+                }
+            }
+        ]
+    }
+
+
+class HashEmbeddingFunction(chromadb.EmbeddingFunction):
+    """Deterministic bag-of-words hashing embedding, so index timings do not depend on a model download"""
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        embeddings = []
+        for text in input:
+            vector = [0.0] * self.dimensions
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dimensions] += 1.0
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
+
+    @staticmethod
+    def name():
+        return 'bench-hash'
+
+    def get_config(self):
+        return {'dimensions': self.dimensions}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(config.get('dimensions', 384))
+
+
+def measure(func, repeat):
+    """Median wall time of func() over repeat runs, plus the peak traced
+    allocation of one extra run (tracing is kept out of the timed runs)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'peak_bytes': peak}, result
+
+
+def bench_extraction(corpus, repeat):
+    results = {}
+    extractors = {
+        'pdf': app.extract_text_from_pdf,
+        'docx': app.extract_text_from_docx,
+        'txt': app.extract_text_from_txt
+    }
+    for kind, extract in extractors.items():
+        size = os.path.getsize(corpus[kind])
+        stats, _ = measure(lambda: extract(corpus[kind]), repeat)
+        stats['mb_per_second'] = size / 1e6 / stats['seconds']
+        results[f'extract_{kind}'] = stats
+
+    # A re-upload of the PDF: its pages come from the gzipped sidecar instead
+    pages, _ = app.extract_pages(corpus['pdf'])
+    app.save_extracted_pages(corpus['pdf'], pages)
+    stats, _ = measure(lambda: list(app.load_extracted_pages(corpus['pdf'])), repeat)
+    stats['sidecar_bytes'] = os.path.getsize(app.sidecar_path(corpus['pdf']))
+    results['extract_pdf_cached'] = stats
+    return results
+
+
+def bench_chunking(text, repeat):
+    stats, chunks = measure(lambda: list(app.iter_chunks(text)), repeat)
+    stats['chunks'] = len(chunks)
+    stats['mb_per_second'] = len(text) / 1e6 / stats['seconds']
+    return {'chunk_text': stats}, chunks
+
+
+def bench_index(chunks, repeat, embedding):
+    """Collection add and query on a fresh in-memory client"""
+    client = chromadb.EphemeralClient()
+    embedding_function = HashEmbeddingFunction() if embedding == 'hash' else None
+    counter = {'run': 0}
+
+    def add():
+        counter['run'] += 1
+        name = f"bench_{counter['run']}"
+        kwargs = {'embedding_function': embedding_function} if embedding_function else {}
+        collection = client.create_collection(name=name, metadata={'hnsw:space': 'cosine'}, **kwargs)
+        for start in range(0, len(chunks), app.app.config['EMBED_BATCH_SIZE']):
+            batch = chunks[start:start + app.app.config['EMBED_BATCH_SIZE']]
+            collection.add(
+                documents=[chunk['text'] for chunk in batch],
+                ids=[f'chunk_{start + i}' for i in range(len(batch))]
+            )
+        return collection
+
+    add_stats, collection = measure(add, repeat)
+    add_stats['chunks_per_second'] = len(chunks) / add_stats['seconds']
+
+    queries = [' '.join(random.Random(i).sample(WORDS, 5)) for i in range(20)]
+    query_stats, _ = measure(
+        lambda: [collection.query(query_texts=[query], n_results=5) for query in queries],
+        repeat
+    )
+    query_stats['seconds_per_query'] = query_stats['seconds'] / len(queries)
+    return {'collection_add': add_stats, 'collection_query': query_stats}
+
+
+def bench_prompt(chunks, deck, repeat):
+    context = '\n\n'.join(chunk['text'] for chunk in chunks[:5])
+    session = {'history': [], 'iterations': 3, 'attempts': 0, 'last_structure': None}
+    for _ in range(3):
+        app.record_feedback(session, deck, 'Add more charts')
+
+    def build():
+        previous = app.build_previous_context(session)
+        return app.build_presentation_prompt('Quarterly review of regional sales', context, previous)
+
+    stats, prompt = measure(build, repeat)
+    stats['prompt_chars'] = len(prompt)
+    return {'prompt_build': stats}
+
+
+def bench_render(deck, repeat):
+    results = {}
+    app.get_theme_template(deck['color_scheme'])  # built once per process, not per render
+    cache_size = app.app.config['SLIDE_CACHE_SIZE']
+    app.app.config['SLIDE_CACHE_SIZE'] = 0  # full renders; memoized re-renders are measured below
+    for mode in ('shapes', 'master'):
+        holder = {}
+
+        def render():
+            holder['prs'] = app.create_presentation(deck, render_mode=mode)
+
+        def save():
+            buffer = BytesIO()
+            holder['prs'].save(buffer)
+            return buffer.tell()
+
+        render_stats, _ = measure(render, repeat)
+        save_stats, size = measure(save, repeat)
+        save_stats['bytes'] = size
+        render_stats['slides_per_second'] = (len(deck['slides']) + 1) / render_stats['seconds']
+        results[f'render_{mode}'] = render_stats
+        results[f'save_{mode}'] = save_stats
+
+    data_deck = data_heavy_deck()
+    results['render_data_heavy'], prs = measure(lambda: app.create_presentation(data_deck), repeat)
+    results['render_data_heavy']['slides'] = len(prs.slides)
+    app.app.config['SLIDE_CACHE_SIZE'] = cache_size
+
+    # A feedback round: the same deck with one slide edited, every other slide memoized
+    app.slide_cache.clear()
+    app.create_presentation(deck)
+    edits = {'count': 0}
+
+    def rerender():
+        edits['count'] += 1
+        edited = dict(deck, slides=list(deck['slides']))
+        edited['slides'][0] = dict(edited['slides'][0], title=f"Edited {edits['count']}")
+        return app.create_presentation(edited)
+
+    results['rerender_one_slide_changed'], _ = measure(rerender, repeat)
+    return results
+
+
+def bench_end_to_end(repeat, delay):
+    """Latency of /generate_presentation against the stub Ollama server"""
+    server = start_stub_server(delay=delay)
+    app.OLLAMA_URL = server.url
+    app.ollama_client = None
+    client = app.app.test_client()
+
+    def generate():
+        response = client.post('/generate_presentation', json={'request': 'Benchmark deck', 'fresh': True})
+        assert response.status_code == 200, response.data
+
+    def first_slide():
+        response = client.post(
+            '/generate_presentation',
+            json={'request': 'Benchmark deck', 'fresh': True, 'stream': True},
+            buffered=False
+        )
+        try:
+            for data in response.response:
+                if b'event: slide' in data:
+                    return
+        finally:
+            response.close()
+
+    results = {}
+    results['generate_e2e'], _ = measure(generate, repeat)
+    stats, _ = measure(first_slide, repeat)
+    results['stream_first_slide'] = stats
+    server.shutdown()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against a baseline"""
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if metric in stats and previous.get(metric):
+                ratio = stats[metric] / previous[metric]
+                if ratio > 1 + tolerance:
+                    regressions.append(f'{name}.{metric}: {previous[metric]:.4g} -> {stats[metric]:.4g} ({ratio:.2f}x)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RAG PowerPoint hot paths')
+    parser.add_argument('--words', type=int, default=20000, help='approximate words per corpus file')
+    parser.add_argument('--slides', type=int, default=40, help='slides in the synthetic deck')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--embedding', choices=('hash', 'default'), default='hash',
+                        help="'default' uses Chroma's embedding model (downloads it on first use)")
+    parser.add_argument('--stub-delay', type=float, default=0.05, help='stub Ollama time to first token')
+    parser.add_argument('--only', nargs='*', help='stage groups to run: extract chunk index prompt render e2e')
+    parser.add_argument('--output', help='write results JSON here as well as to stdout')
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional regression')
+    parser.add_argument('--save-baseline', help='write these results as the new baseline')
+    args = parser.parse_args()
+
+    groups = set(args.only or ('extract', 'chunk', 'index', 'prompt', 'render', 'e2e'))
+    results = {}
+    deck = synthetic_deck(args.slides)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = build_corpus(directory, args.words)
+        if 'extract' in groups:
+            results.update(bench_extraction(corpus, args.repeat))
+        text = app.extract_text_from_txt(corpus['txt'])
+        chunk_results, chunks = bench_chunking(text, args.repeat)
+        if 'chunk' in groups:
+            results.update(chunk_results)
+        if 'index' in groups:
+            results.update(bench_index(chunks, args.repeat, args.embedding))
+        if 'prompt' in groups:
+            results.update(bench_prompt(chunks, deck, args.repeat))
+    if 'render' in groups:
+        results.update(bench_render(deck, args.repeat))
+    if 'e2e' in groups:
+        results.update(bench_end_to_end(args.repeat, args.stub_delay))
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'words': args.words,
+            'slides': args.slides,
+            'repeat': args.repeat,
+            'embedding': args.embedding
+        },
+        'results': results
+    }
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            report['regressions'] = compare(results, json.load(file), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            file.write(output)
+
+    if report.get('regressions'):
+        print('Regressions:\n  ' + '\n  '.join(report['regressions']), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Load-test the sync (Flask) and async (ASGI) serving modes against a stub Ollama.
+
+    python tools/loadtest.py                               # both modes at 1..200 concurrent requests
+    python tools/loadtest.py --levels 50 200 500 --delay 2 --stream --output load.json
+
+Each mode runs as its own server process with OLLAMA_URL pointing at an
+in-process stub that answers after --delay seconds. At every concurrency level
+that many clients post distinct /generate_presentation requests at once (so the
+response cache never answers) and the report lists latency percentiles,
+throughput, failures and the server's peak thread count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_ollama import start_stub_server  # noqa: E402
+
+SERVER_COMMANDS = {
+    # What `python app.py` runs, minus the debugger and reloader
+    'sync': [sys.executable, '-c', 'import sys, app; app.app.run(port=int(sys.argv[1]), threaded=True)'],
+    'async': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--log-level', 'warning', '--port']
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, ollama_url, ollama_concurrency):
+    port = free_port()
+    env = dict(
+        os.environ,
+        OLLAMA_URL=ollama_url,
+        OLLAMA_MAX_CONCURRENCY=str(ollama_concurrency),
+        OLLAMA_QUEUE_TIMEOUT='600',
+        WARM_INDEX='0',
+        CHROMA_PATH='',
+        SESSION_DB=''
+    )
+    process = subprocess.Popen(SERVER_COMMANDS[mode] + [str(port)], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} server exited with status {process.returncode}')
+        try:
+            with urllib.request.urlopen(f'{url}/sessions/stats', timeout=1):
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start within 60s')
+
+
+def thread_count(pid):
+    """Threads of a process from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+class ThreadSampler:
+    """Track a process's peak thread count while a level runs"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = thread_count(pid)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            count = thread_count(self.pid)
+            if count is not None:
+                self.peak = max(self.peak or 0, count)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+async def one_request(session, url, stream):
+    """Post one generation; returns (seconds, seconds to first slide or None, ok)"""
+    payload = {'request': f'Load test deck {uuid.uuid4().hex}', 'stream': stream}
+    started = time.perf_counter()
+    first_slide = None
+    ok = False
+    try:
+        async with session.post(f'{url}/generate_presentation', json=payload) as response:
+            if not stream:
+                ok = response.status == 200 and 'structure' in await response.json()
+            else:
+                async for line in response.content:
+                    line = line.strip()
+                    if line == b'event: slide' and first_slide is None:
+                        first_slide = time.perf_counter() - started
+                    elif line == b'event: done':
+                        ok = response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        pass
+    return time.perf_counter() - started, first_slide, ok
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def run_level(url, concurrency, stream, timeout):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one_request(session, url, stream) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies = [seconds for seconds, _, ok in results if ok]
+    first_slides = [first for _, first, ok in results if ok and first is not None]
+    report = {
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'failed': len(results) - len(latencies),
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(latencies) / wall, 2) if wall else 0.0
+    }
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        value = percentile(latencies, fraction)
+        report[f'{name}_seconds'] = round(value, 3) if value is not None else None
+    report['max_seconds'] = round(max(latencies), 3) if latencies else None
+    if stream:
+        value = percentile(first_slides, 0.5)
+        report['first_slide_p50_seconds'] = round(value, 3) if value is not None else None
+    return report
+
+
+def run_mode(mode, stub_url, args):
+    process, url = start_server(mode, stub_url, args.ollama_concurrency)
+    reports = []
+    try:
+        asyncio.run(run_level(url, 1, args.stream, args.timeout))  # warm-up
+        for concurrency in args.levels:
+            with ThreadSampler(process.pid) as sampler:
+                report = asyncio.run(run_level(url, concurrency, args.stream, args.timeout))
+            report['peak_threads'] = sampler.peak
+            reports.append(report)
+            print_row(mode, report)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return reports
+
+
+def print_row(mode, report):
+    def seconds(value):
+        return f'{value:7.2f}' if value is not None else '      -'
+    print(f"{mode:>5} {report['concurrency']:6d} {report['ok']:5d} {report['failed']:6d} "
+          f"{seconds(report['p50_seconds'])} {seconds(report['p95_seconds'])} {seconds(report['max_seconds'])} "
+          f"{report['requests_per_second']:8.2f} {report['peak_threads'] or '-':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 10, 50, 100, 200],
+                        help='concurrent requests per level')
+    parser.add_argument('--delay', type=float, default=1.0, help='stub seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='stub streaming rate (0 = instant)')
+    parser.add_argument('--ollama-concurrency', type=int, default=1000,
+                        help='OLLAMA_MAX_CONCURRENCY for the servers, high so the stub is never queued for')
+    parser.add_argument('--stream', action='store_true', help='request SSE streams and time the first slide')
+    parser.add_argument('--timeout', type=float, default=300, help='client timeout per request')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    stub = start_stub_server(delay=args.delay, tokens_per_second=args.tokens_per_second)
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+
+    print(f"{'mode':>5} {'conc':>6} {'ok':>5} {'failed':>6} {'p50 s':>7} {'p95 s':>7} {'max s':>7} "
+          f"{'req/s':>8} {'threads':>8}")
+    results = {
+        'delay': args.delay,
+        'stream': args.stream,
+        'modes': {mode: run_mode(mode, stub.url, args) for mode in modes}
+    }
+    stub.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
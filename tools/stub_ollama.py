@@ -0,0 +1,150 @@
+"""Minimal stand-in for Ollama's /api/generate, for local testing and benchmarks.
+
+    python tools/stub_ollama.py --port 11435 --delay 0.5 --tokens-per-second 200
+    OLLAMA_URL=http://localhost:11435/api/generate python app.py
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_DECK = {
+    "title": "Stub Presentation",
+    "subtitle": "Generated by the stub Ollama server",
+    "color_scheme": "corporate_blue",
+    "slides": [
+        {
+            "type": "bullet",
+            "layout": "bullet",
+            "title": "Overview",
+            "points": ["First point", "Second point", "Third point"]
+        },
+        {
+            "type": "chart",
+            "title": "Quarterly Results",
+            "chart_data": {
+                "type": "column",
+                "categories": ["Q1", "Q2", "Q3"],
+                "series": [{"name": "Sales", "values": [100, 150, 200]}]
+            }
+        },
+        {
+            "type": "table",
+            "title": "Summary",
+            "table_data": {
+                "headers": ["Metric", "Value"],
+                "rows": [["Revenue", "1.2M"], ["Growth", "12%"]]
+            }
+        }
+    ]
+}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+    request_count = 0
+
+    def handle_error(self, request, client_address):
+        # Clients abandoning a stream half way is expected; stay quiet about it
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(delay=0.0, tokens_per_second=0.0, failure_rate=0.0, response_text=None):
+    """Build a request handler class with the given simulated behaviour"""
+    text = response_text if response_text is not None else json.dumps(SAMPLE_DECK, indent=2)
+
+    class StubOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            self.server.request_count += 1
+
+            if failure_rate and random.random() < failure_rate:
+                self.send_json(503, {'error': 'stub overloaded'})
+                return
+
+            time.sleep(delay)
+            pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+            per_piece = 1.0 / tokens_per_second if tokens_per_second else 0.0
+            started = time.perf_counter()
+
+            if payload.get('stream', True):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for piece in pieces:
+                    time.sleep(per_piece)
+                    self.write_chunk({'model': payload.get('model'), 'response': piece, 'done': False})
+                self.write_chunk(self.final_message(payload, len(pieces), started))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                time.sleep(per_piece * len(pieces))
+                body = self.final_message(payload, len(pieces), started)
+                body['response'] = text
+                self.send_json(200, body)
+
+        def final_message(self, payload, eval_count, started):
+            return {
+                'model': payload.get('model'),
+                'response': '',
+                'done': True,
+                'prompt_eval_count': len(payload.get('prompt', '')) // 4,
+                'eval_count': eval_count,
+                'eval_duration': int((time.perf_counter() - started) * 1e9) or 1
+            }
+
+        def write_chunk(self, message):
+            data = (json.dumps(message) + '\n').encode('utf-8')
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubOllamaHandler
+
+
+def start_stub_server(port=0, **behaviour):
+    """Serve the stub on a background thread; returns the server (see server.url)"""
+    server = StubServer(('127.0.0.1', port), make_handler(**behaviour))
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+    threading.Thread(target=server.serve_forever, name='stub-ollama', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='0 streams as fast as possible')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), make_handler(
+        delay=args.delay,
+        tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate
+    ))
+    print(f'Stub Ollama listening on http://127.0.0.1:{args.port}/api/generate')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()